@@ -3,11 +3,7 @@
 #
 
 
-import sys
-
-from airbyte_cdk.entrypoint import launch
-from source_kintone import SourceKintone
+from source_kintone.run import run
 
 if __name__ == "__main__":
-    source = SourceKintone()
-    launch(source, sys.argv[1:])
+    run()
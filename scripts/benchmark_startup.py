@@ -0,0 +1,47 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+"""
+Startup time of each connector command, up to the point where it starts talking to kintone.
+
+Usage: python scripts/benchmark_startup.py [--runs 5]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parents[1]
+
+# Everything each command loads before it starts talking to kintone
+STARTUP_SNIPPETS = {
+    "spec": "from source_kintone.run import run; run(['spec'])",
+    "check": "from airbyte_cdk.entrypoint import launch; from source_kintone.source import SourceKintone; SourceKintone()",
+    "discover": "from airbyte_cdk.entrypoint import launch; from source_kintone.source import SourceKintone; import source_kintone.streams",
+    "read": "from airbyte_cdk.entrypoint import launch; from source_kintone.source import SourceKintone; import source_kintone.streams",
+}
+
+
+def startup_time(snippet: str, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", snippet], cwd=ROOT, check=True, capture_output=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Median startup time of each connector command")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    for command, snippet in STARTUP_SNIPPETS.items():
+        print(f"{command} startup: {startup_time(snippet, args.runs) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
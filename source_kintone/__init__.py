@@ -3,6 +3,12 @@
 #
 
 
-from .source import SourceKintone
+def __getattr__(name):
+  # Import the source lazily, so that `spec` does not pay for the CDK import
+  if name == "SourceKintone":
+    from .source import SourceKintone
+    return SourceKintone
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = ["SourceKintone"]
@@ -1,62 +1,49 @@
 # import concurrent.futures
-import json
 import logging
-import time
-import uuid
-from datetime import datetime, timedelta
-from typing import Any, List, Mapping, Optional, Tuple
+import threading
+from typing import Any, List, Mapping, Optional
 
 import requests  # type: ignore[import]
-from airbyte_cdk.models import ConfiguredAirbyteCatalog
 from requests import adapters as request_adapters
 # type: ignore[import]
 from requests.exceptions import HTTPError, RequestException
 
-from source_kintone.utils import encode_to_base64
+from source_kintone.errors import (AUTH, KINTONE_ERROR_INDEX, PERMISSION,
+                                   UNKNOWN_ERROR_MESSAGE, classify_error)
+from source_kintone.utils import (batch_apps_by_tokens, build_api_url,
+                                  encode_to_base64, group_api_tokens,
+                                  join_api_tokens)
 
 from .exceptions import KintoneException
 from .rate_limiting import default_backoff_handler
 
-KINTONE_ERROR = [
-    {"code": "CB_AU01", "message": "ログインしてください。"},
-    {"code": "CB_NO02", "message": "権限がありません。"},
-    {"code": "CB_IJ01", "message": "不正なJSON文字列です。"},
-    {"code": "CB_IL02", "message": "謎のエラー"},
-    {"code": "CB_TW02", "message": "2要素認証を有効にしているため、認証できません。REST APIでは2要素認証はサポートされていません。"},
-    {"code": "CB_VA01", "message": "クエリ記法が間違っています。"},
-    {"code": "GAIA_FU01", "message": "フィールド「XXXXX」の編集権限がありません。"},
-    {"code": "GAIA_IL23",
-     "message": "ゲストスペース内のアプリを操作する場合は、ゲストスペースのID を追加してください。"},
-    {"code": "GAIA_IL26", "message": "指定したユーザー(code:XXXXXX)が見つかりません。"},
-    {"code": "GAIA_IL28", "message": "指定した組織(code:XXXXXX)が見つかりません。"},
-    {"code": "GAIA_IL42", "message": "レコードの絞り込み条件に指定したユーザー、グループ、または組織が存在しません。削除された可能性があります。"},
-    {"code": "GAIA_IQ03", "message": "作業者フィールドのフィールドタイプには演算子=を使用できません。"},
-    {"code": "GAIA_IQ07",
-     "message": "レコードを読み込めません。テーブルに設定している場合、数値フィールドのフィールドタイプには、演算子=を使用できません。"},
-    {"code": "GAIA_IQ11", "message": "指定されたフィールド(XXXX)が見つかりません。"},
-    {"code": "GAIA_IR02",
-     "message": "フィールド「xxxxx」に指定したクエリが正しくありません。指定したクエリは、関連レコード一覧フィールドでのみ使用できます。"},
-    {"code": "GAIA_LO03",
-     "message": "ルックアップの参照先から値をコピーできません。「コピー元のフィールド」に指定したフィールドの設定で「値の重複を禁止する」を選択しておく必要があります。"},
-    {"code": "GAIA_LT01",
-     "message": "データベースがロックされているため、操作に失敗しました。時間をおいて再度お試しください。"},
-    {"code": "GAIA_DA02",
-     "message": "データベースがロックされているため、操作に失敗しました。時間をおいて再度お試しください。"},
-    {"code": "GAIA_NT01", "message": "作業者のみがステータスを変更できます"},
-    {"code": "GAIA_NO01", "message": "このAPIトークンでは、指定したAPIを実行できません。"},
-    {"code": "GAIA_TM12",
-     "message": "作成できるカーソルの上限に達しているため、カーソルを作成できません。不要なカーソルを削除するか、しばらく経ってから再実行してください。"},
-    {"code": "GAIA_UN03", "message": "レコードを再読み込みしてください。編集中に、ほかのユーザーがレコードを更新しました"},
-]
-
 SUCCESS_CODE = 200
+# kintone returns at most 100 apps per app list request
+APPS_PAGE_SIZE = 100
 API_KEY_AUTHENTICATION = 'api_key'
 USERNAME_PASSWORD_AUTHENTICATION = 'username_password'
+# Sized for the concurrent request limit of kintone, shared by every domain of the connector run
+CONNECTION_POOL_SIZE = 100
+# Error returned for the apps and spaces of a guest space requested without its guest space ID
+GUEST_SPACE_ERROR_CODE = "GAIA_IL23"
+
+_shared_adapter = None
+_shared_adapter_lock = threading.Lock()
+
+
+def get_shared_adapter() -> request_adapters.HTTPAdapter:
+  """HTTP adapter mounted on every session of this process, so that all sessions and domains share one connection pool"""
+  global _shared_adapter
+  with _shared_adapter_lock:
+    if _shared_adapter is None:
+      _shared_adapter = request_adapters.HTTPAdapter(
+          pool_connections=CONNECTION_POOL_SIZE, pool_maxsize=CONNECTION_POOL_SIZE)
+    return _shared_adapter
 
 
 class Kintone:
   logger = logging.getLogger("airbyte")
-  parallel_tasks_size = 100
+  parallel_tasks_size = CONNECTION_POOL_SIZE
 
   def __init__(
       self,
@@ -71,46 +58,35 @@ class Kintone:
     self.auth_option = auth_type.get('option', None)
     self.username = auth_type.get('username', None)
     self.password = auth_type.get('password', None)
+    self.api_tokens = group_api_tokens(auth_type.get('api_tokens', []))
     self.include_label = include_label
 
     self.authentication_error = None
     self.session = requests.Session()
 
     # Change the connection pool size. Default value is not enough for parallel tasks
-    adapter = request_adapters.HTTPAdapter(
-        pool_connections=self.parallel_tasks_size, pool_maxsize=self.parallel_tasks_size)
-    self.session.mount("https://", adapter)
+    self.session.mount("https://", get_shared_adapter())
 
   def authentication(self):
-    # Get all apps of this account
-    get_apps_url = f"{self.domain}/k/v1/apps.json"
     try:
-      # Authentication request does not need retry handler
-      app_list_res = self.session.get(
-          url=get_apps_url,
-          headers=self._get_standard_headers()
-      )
-      app_list_res.raise_for_status()
-      app_list = app_list_res.json().get('apps', [])
-      if len(app_list) == 0:
+      app_routes = self.get_app_routes()
+      if len(app_routes) == 0:
         self.authentication_error = 'このアカウントでアプリがありません。'
         return
 
-      filtered_app_list = [{"appId": obj["appId"], "spaceId": obj["spaceId"]}
-                           for obj in app_list]
       for item in self.app_ids:
-        matching_app = next(
-            (app for app in filtered_app_list if app['appId'] == item), None)
-        if matching_app is None:
+        if item not in app_routes:
           self.authentication_error = '存在していないアプリのアプリIDがあります。'
           break
 
         # Log current app fields
         self.logger.info(f"===========FIELDS IN APP_{item}===========")
-        get_app_field_url = f"{self.domain}/k/v1/app/form/fields.json?app={item}&lang=ja"
+        get_app_field_url = build_api_url(
+            self.domain, "app/form/fields.json", app_routes[item])
         app_field_res = self.session.get(
             url=get_app_field_url,
-            headers=self._get_standard_headers()
+            params={"app": item, "lang": "ja"},
+            headers=self._get_standard_headers(app_ids=[item])
         )
         app_field = app_field_res.json().get('properties', [])
         for key, value in app_field.items():
@@ -119,27 +95,72 @@ class Kintone:
         self.logger.info(
             f"===================END OF FIELD IN APP_{item}=======================")
 
-        if matching_app['spaceId'] is None:
-          # This app belongs to the current Organization
-          continue
-        # Check if this app is in Public Space
-        get_space_detail_url = f"{self.domain}/k/v1/space.json"
-        params = {"id": matching_app['spaceId']}
-
-        space_detail_res = self.session.get(
-            url=get_space_detail_url,
-            params=params,
-            headers=self._get_standard_headers()
-        )
-        if space_detail_res.status_code is not SUCCESS_CODE:
-          self.authentication_error = 'ゲストスペース内のアプリがあります。'
-          break
-
     except requests.exceptions.RequestException as err:
-      self.authentication_error = 'この情報では認証できません。'
-      self.logger.warn(f"API Error: {err.response.text}")
+      error = classify_error(err.response)
+      if error.category == AUTH:
+        self.authentication_error = 'この情報では認証できません。'
+      else:
+        self.authentication_error = error.message
+      self.logger.warn(f"API Error ({error.category}): {err}")
       return
 
+  def get_app_routes(self) -> Mapping[str, Optional[str]]:
+    """
+    Routing table of the configured apps: app ID -> guest space ID, or None for apps served at /k/v1.
+    Built from the app list plus one lookup per distinct space, then saved by discover into the catalog for read.
+    Apps missing from the table do not exist or are not visible to this account.
+    With API tokens, the app list request also validates every token in a single batch.
+    """
+    # Authentication request does not need retry handler
+    if self.auth_option == API_KEY_AUTHENTICATION:
+      app_id_batches = batch_apps_by_tokens(self.api_tokens, self.app_ids, APPS_PAGE_SIZE)
+    else:
+      app_id_batches = [self.app_ids[start:start + APPS_PAGE_SIZE]
+                        for start in range(0, len(self.app_ids), APPS_PAGE_SIZE)]
+    app_list = []
+    for chunk in app_id_batches:
+      app_list_res = self.session.get(
+          url=f"{self.domain}/k/v1/apps.json",
+          params={f"ids[{index}]": app_id for index, app_id in enumerate(chunk)},
+          headers=self._get_standard_headers(app_ids=chunk)
+      )
+      app_list_res.raise_for_status()
+      app_list.extend(app_list_res.json().get('apps', []))
+
+    guest_spaces = {}
+    app_routes = {}
+    for app in app_list:
+      space_id = app["spaceId"]
+      if space_id is None:
+        # This app belongs to the current Organization
+        app_routes[app["appId"]] = None
+        continue
+      if space_id not in guest_spaces:
+        guest_spaces[space_id] = self._is_guest_space(space_id, app["appId"])
+      app_routes[app["appId"]] = space_id if guest_spaces[space_id] else None
+
+    return app_routes
+
+  def _is_guest_space(self, space_id: str, app_id: str) -> bool:
+    """Guest spaces are the ones kintone refuses to serve at /k/v1, asking for their guest space ID instead"""
+    if self.auth_option == API_KEY_AUTHENTICATION:
+      # Space APIs do not accept API tokens, so the app itself is probed with its own tokens
+      url, params, headers = f"{self.domain}/k/v1/app.json", {"id": app_id}, self._get_standard_headers(app_ids=[app_id])
+    else:
+      url, params, headers = f"{self.domain}/k/v1/space.json", {"id": space_id}, self._get_standard_headers()
+    try:
+      self._make_request("GET", url, headers=headers, params=params)
+      return False
+    except HTTPError as err:
+      error = classify_error(err.response)
+      if error.code == GUEST_SPACE_ERROR_CODE:
+        return True
+      if error.category == PERMISSION:
+        # A private space this account is not a member of still serves its apps at /k/v1
+        self.logger.warn(f"Space {space_id} could not be checked ({error.message}), its apps are read at /k/v1")
+        return False
+      raise
+
   @default_backoff_handler(max_tries=5, factor=5)
   def _make_request(
       self,
@@ -162,16 +183,18 @@ class Kintone:
       raise
     return resp
 
-  def _get_standard_headers(self) -> Mapping[str, str]:
+  def _get_standard_headers(self, app_ids: List[str] = None) -> Mapping[str, str]:
+    if self.auth_option == API_KEY_AUTHENTICATION:
+      return {
+          "X-Cybozu-API-Token": join_api_tokens(self.api_tokens, app_ids or self.app_ids)
+      }
     return {
         "X-Cybozu-Authorization": self._get_authorization_key()
     }
 
   def _get_error_message(self, error_code: str) -> str:
-    for error in KINTONE_ERROR:
-      if error_code == error['code']:
-        return error['message']
-    return "不明なシステムエラーが発生しました。"
+    error = KINTONE_ERROR_INDEX.get(error_code)
+    return error['message'] if error is not None else UNKNOWN_ERROR_MESSAGE
 
   def _get_authorization_key(self) -> str:
     if self.auth_option == USERNAME_PASSWORD_AUTHENTICATION:
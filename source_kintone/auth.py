@@ -1,5 +1,5 @@
 
-from typing import Any, Mapping
+from typing import Any, List, Mapping
 
 from airbyte_cdk.sources.streams.http.requests_native_auth.abstract_token import \
     AbstractHeaderAuthenticator
@@ -20,3 +20,18 @@ class KintoneAuthenticator(AbstractHeaderAuthenticator):
     self._auth_header = auth_header
     self._auth_method = auth_method
     self._token = encode_to_base64(f"{username}:{password}")
+
+
+class KintoneApiTokenAuthenticator(AbstractHeaderAuthenticator):
+  @property
+  def auth_header(self) -> str:
+    return self._auth_header
+
+  @property
+  def token(self) -> str:
+    return f"{self._token}"
+
+  def __init__(self, api_tokens: List[str], auth_header: str = "X-Cybozu-API-Token"):
+    self._auth_header = auth_header
+    # Several app tokens are sent comma separated in a single header
+    self._token = ",".join(api_tokens)
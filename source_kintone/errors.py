@@ -0,0 +1,102 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+
+from typing import Any, Mapping, NamedTuple, Optional
+
+import requests  # type: ignore[import]
+
+# Error categories, they decide whether a failed request is retried and how it is reported
+RETRYABLE = "retryable"
+QUOTA = "quota"
+AUTH = "auth"
+PERMISSION = "permission"
+QUERY_SYNTAX = "query_syntax"
+UNKNOWN = "unknown"
+
+UNKNOWN_ERROR_MESSAGE = "不明なシステムエラーが発生しました。"
+
+KINTONE_ERROR = [
+    {"code": "CB_AU01", "category": AUTH, "message": "ログインしてください。"},
+    {"code": "CB_NO02", "category": PERMISSION, "message": "権限がありません。"},
+    {"code": "CB_IJ01", "category": QUERY_SYNTAX, "message": "不正なJSON文字列です。"},
+    {"code": "CB_IL02", "category": UNKNOWN, "message": "謎のエラー"},
+    {"code": "CB_TW02", "category": AUTH,
+     "message": "2要素認証を有効にしているため、認証できません。REST APIでは2要素認証はサポートされていません。"},
+    {"code": "CB_VA01", "category": QUERY_SYNTAX, "message": "クエリ記法が間違っています。"},
+    {"code": "GAIA_FU01", "category": PERMISSION, "message": "フィールド「XXXXX」の編集権限がありません。"},
+    {"code": "GAIA_IL23", "category": PERMISSION,
+     "message": "ゲストスペース内のアプリを操作する場合は、ゲストスペースのID を追加してください。"},
+    {"code": "GAIA_IL26", "category": QUERY_SYNTAX, "message": "指定したユーザー(code:XXXXXX)が見つかりません。"},
+    {"code": "GAIA_IL28", "category": QUERY_SYNTAX, "message": "指定した組織(code:XXXXXX)が見つかりません。"},
+    {"code": "GAIA_IL42", "category": QUERY_SYNTAX,
+     "message": "レコードの絞り込み条件に指定したユーザー、グループ、または組織が存在しません。削除された可能性があります。"},
+    {"code": "GAIA_IQ03", "category": QUERY_SYNTAX, "message": "作業者フィールドのフィールドタイプには演算子=を使用できません。"},
+    {"code": "GAIA_IQ07", "category": QUERY_SYNTAX,
+     "message": "レコードを読み込めません。テーブルに設定している場合、数値フィールドのフィールドタイプには、演算子=を使用できません。"},
+    {"code": "GAIA_IQ11", "category": QUERY_SYNTAX, "message": "指定されたフィールド(XXXX)が見つかりません。"},
+    {"code": "GAIA_IR02", "category": QUERY_SYNTAX,
+     "message": "フィールド「xxxxx」に指定したクエリが正しくありません。指定したクエリは、関連レコード一覧フィールドでのみ使用できます。"},
+    {"code": "GAIA_LO03", "category": UNKNOWN,
+     "message": "ルックアップの参照先から値をコピーできません。「コピー元のフィールド」に指定したフィールドの設定で「値の重複を禁止する」を選択しておく必要があります。"},
+    {"code": "GAIA_LT01", "category": RETRYABLE,
+     "message": "データベースがロックされているため、操作に失敗しました。時間をおいて再度お試しください。"},
+    {"code": "GAIA_DA02", "category": RETRYABLE,
+     "message": "データベースがロックされているため、操作に失敗しました。時間をおいて再度お試しください。"},
+    {"code": "GAIA_NT01", "category": PERMISSION, "message": "作業者のみがステータスを変更できます"},
+    {"code": "GAIA_NO01", "category": PERMISSION, "message": "このAPIトークンでは、指定したAPIを実行できません。"},
+    {"code": "GAIA_TM12", "category": QUOTA,
+     "message": "作成できるカーソルの上限に達しているため、カーソルを作成できません。不要なカーソルを削除するか、しばらく経ってから再実行してください。"},
+    {"code": "GAIA_UN03", "category": RETRYABLE, "message": "レコードを再読み込みしてください。編集中に、ほかのユーザーがレコードを更新しました"},
+    {"code": "REQUEST_LIMIT_EXCEEDED", "category": QUOTA, "message": "API Call limit is exceeded"},
+]
+
+# Built once at import time, so every lookup by error code is O(1)
+KINTONE_ERROR_INDEX = {error["code"]: error for error in KINTONE_ERROR}
+
+
+class KintoneError(NamedTuple):
+  category: str
+  message: str
+  code: Optional[str] = None
+  status_code: Optional[int] = None
+
+
+def get_error_body(response: requests.Response) -> Mapping[str, Any]:
+  """kintone returns a single JSON object on error, but the body may also be a list, HTML or empty"""
+  try:
+    body = response.json()
+  except ValueError:
+    return {}
+  if isinstance(body, list):
+    body = body[0] if body else {}
+  return body if isinstance(body, dict) else {}
+
+
+def _category_from_status(status_code: Optional[int]) -> str:
+  if status_code is None:
+    # No response at all, eg: connection errors and timeouts
+    return RETRYABLE
+  if status_code == requests.codes.too_many_requests or status_code >= 500:
+    return RETRYABLE
+  if status_code == requests.codes.unauthorized:
+    return AUTH
+  if status_code == requests.codes.forbidden:
+    return PERMISSION
+  return UNKNOWN
+
+
+def classify_error(response: Optional[requests.Response]) -> KintoneError:
+  if response is None:
+    return KintoneError(category=RETRYABLE, message=UNKNOWN_ERROR_MESSAGE)
+
+  status_code = response.status_code
+  body = get_error_body(response)
+  code = body.get("code") or body.get("errorCode")
+  known_error = KINTONE_ERROR_INDEX.get(code)
+  if known_error is not None:
+    return KintoneError(category=known_error["category"], message=known_error["message"], code=code, status_code=status_code)
+
+  message = body.get("message") if isinstance(body.get("message"), str) else UNKNOWN_ERROR_MESSAGE
+  return KintoneError(category=_category_from_status(status_code), message=message, code=code, status_code=status_code)
@@ -0,0 +1,157 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Mapping, NamedTuple, Optional, Tuple
+
+from requests.exceptions import RequestException
+
+from source_kintone.api import Kintone
+from source_kintone.errors import classify_error
+from source_kintone.source import DEFAULT_MEMORY_LIMIT_MB, SourceKintone
+from source_kintone.streams import AppComments, AppDetail, AppRecordActivity
+from source_kintone.utils import build_api_url
+
+# kintone accepts 10,000 requests per app and per day
+DAILY_REQUEST_LIMIT = 10000
+# Number of records read by the probe to estimate the size of a record
+SAMPLE_SIZE = 10
+PLAN_PARALLEL_TASKS = 10
+
+
+class AppPlan(NamedTuple):
+  domain: str
+  app_id: str
+  records: int = 0
+  fields: int = 0
+  page_size: int = 0
+  pages: int = 0
+  requests: int = 0
+  bytes: int = 0
+  seconds: float = 0
+  # Set when the app could not be probed, the estimates are then left empty
+  error: Optional[str] = None
+
+  @property
+  def quota_usage(self) -> float:
+    return self.requests / DAILY_REQUEST_LIMIT
+
+
+def _estimate_page_size(record_bytes: int, memory_limit: int) -> int:
+  """Page size AppDetail settles on once the first page showed the size of the records"""
+  if record_bytes == 0:
+    return AppDetail.page_size
+  return max(1, min(AppDetail.page_size, int(memory_limit * AppDetail.page_memory_ratio // record_bytes)))
+
+
+def plan_app(kintone: Kintone, config: Mapping[str, Any], app_id: str, guest_space_id: Optional[str]) -> AppPlan:
+  """
+  Estimate the cost of a full sync of one app from two cheap probes:
+  the first records of the app with their total count, and the form fields of the app.
+  """
+  headers = kintone._get_standard_headers(app_ids=[app_id])
+  records_res = kintone._make_request(
+      "GET", build_api_url(kintone.domain, "records.json", guest_space_id), headers=headers,
+      params={"app": app_id, "query": f"limit {SAMPLE_SIZE}", "totalCount": "true"})
+  fields_res = kintone._make_request(
+      "GET", build_api_url(kintone.domain, "app/form/fields.json", guest_space_id), headers=headers,
+      params={"app": app_id})
+
+  records_json = records_res.json()
+  total_count = int(records_json["totalCount"])
+  sample_count = len(records_json["records"])
+  record_bytes = len(records_res.content) // sample_count if sample_count else 0
+  fields = len(fields_res.json()["properties"])
+
+  # The form fields request is a fixed cost, the records request also pays for reading its records
+  request_seconds = fields_res.elapsed.total_seconds()
+  record_seconds = max(records_res.elapsed.total_seconds() - request_seconds, 0) / sample_count if sample_count else 0
+
+  memory_limit = config.get('memory_limit_mb', DEFAULT_MEMORY_LIMIT_MB) * 1024 * 1024
+  page_size = _estimate_page_size(record_bytes, memory_limit)
+  # AppDetail always reads the first page at the default size, only the following pages use the reduced size
+  pages = 1 + math.ceil(max(total_count - AppDetail.page_size, 0) / page_size)
+  # One schema request, then the pages of records
+  requests = 1 + pages
+  seconds = request_seconds + pages * request_seconds + total_count * record_seconds
+
+  activity_pages = max(1, math.ceil(total_count / AppRecordActivity.page_size))
+  if config.get('include_process_management', False):
+    requests += 1 + activity_pages
+    seconds += (1 + activity_pages) * request_seconds
+  if config.get('include_comments', False):
+    # At least one comments request per record, sent concurrently
+    requests += 1 + activity_pages + total_count
+    seconds += (1 + activity_pages) * request_seconds + total_count * request_seconds / AppComments.parallel_tasks_size
+
+  return AppPlan(
+      domain=kintone.domain,
+      app_id=app_id,
+      records=total_count,
+      fields=fields,
+      page_size=page_size,
+      pages=pages,
+      requests=requests,
+      bytes=total_count * record_bytes,
+      seconds=seconds,
+  )
+
+
+def _get_error_message(err: Exception) -> str:
+  if isinstance(err, RequestException):
+    return classify_error(err.response).message
+  return str(err)
+
+
+def _get_app_routes_or_error(kintone: Kintone) -> Tuple[Optional[Mapping[str, Optional[str]]], Optional[str]]:
+  try:
+    return kintone.get_app_routes(), None
+  except (RequestException, KeyError, ValueError) as err:
+    return None, _get_error_message(err)
+
+
+def _plan_app_or_error(kintone: Kintone, config: Mapping[str, Any], app_id: str, app_routes: Optional[Mapping[str, Optional[str]]],
+                       routes_error: Optional[str]) -> AppPlan:
+  # An app that cannot be probed is reported in its own row, the other apps are still planned
+  if routes_error is not None:
+    return AppPlan(domain=kintone.domain, app_id=app_id, error=routes_error)
+  try:
+    return plan_app(kintone, config, app_id, app_routes.get(app_id))
+  except (RequestException, KeyError, ValueError) as err:
+    return AppPlan(domain=kintone.domain, app_id=app_id, error=_get_error_message(err))
+
+
+def plan_sync(config: Mapping[str, Any]) -> List[AppPlan]:
+  """Look up the routes of every domain, then probe every app, concurrently and without reading their records"""
+  tenant_configs = SourceKintone.get_tenant_configs(config)
+  kintones = [Kintone(**tenant_config) for tenant_config in tenant_configs]
+  with ThreadPoolExecutor(max_workers=PLAN_PARALLEL_TASKS) as executor:
+    tenant_app_routes = list(executor.map(_get_app_routes_or_error, kintones))
+    probes = [
+        (kintone, tenant_config, app_id, app_routes, routes_error)
+        for kintone, tenant_config, (app_routes, routes_error) in zip(kintones, tenant_configs, tenant_app_routes)
+        for app_id in tenant_config["app_ids"]
+    ]
+    return list(executor.map(lambda probe: _plan_app_or_error(*probe), probes))
+
+
+def format_plan(plans: List[AppPlan]) -> str:
+  header = ("DOMAIN", "APP", "RECORDS", "FIELDS", "PAGE SIZE", "PAGES", "REQUESTS", "MB", "MINUTES", "DAILY QUOTA", "ERROR")
+  rows = [header]
+  for plan in plans:
+    if plan.error is not None:
+      rows.append((plan.domain, plan.app_id, *["-"] * (len(header) - 3), plan.error))
+      continue
+    quota = f"{plan.quota_usage:.0%}" + (" (exceeded)" if plan.quota_usage > 1 else "")
+    rows.append((plan.domain, plan.app_id, str(plan.records), str(plan.fields), str(plan.page_size), str(plan.pages),
+                 str(plan.requests), f"{plan.bytes / 1024 / 1024:.1f}", f"{plan.seconds / 60:.1f}", quota, ""))
+  # Streams are read one after the other, so the wall time of the sync is the sum of the apps
+  rows.append(("TOTAL", "", str(sum(plan.records for plan in plans)), "", "", str(sum(plan.pages for plan in plans)),
+               str(sum(plan.requests for plan in plans)), f"{sum(plan.bytes for plan in plans) / 1024 / 1024:.1f}",
+               f"{sum(plan.seconds for plan in plans) / 60:.1f}", "", ""))
+
+  widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+  return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows)
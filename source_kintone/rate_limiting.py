@@ -5,11 +5,14 @@
 
 
 import sys
+import threading
 
 import backoff
 from airbyte_cdk.logger import AirbyteLogger
 from airbyte_cdk.sources.streams.http.exceptions import DefaultBackoffException
-from requests import codes, exceptions  # type: ignore[import]
+from requests import exceptions  # type: ignore[import]
+
+from source_kintone.errors import RETRYABLE, classify_error
 
 TRANSIENT_EXCEPTIONS = (
     DefaultBackoffException,
@@ -21,6 +24,20 @@ TRANSIENT_EXCEPTIONS = (
 
 logger = AirbyteLogger()
 
+# kintone accepts at most 100 concurrent requests per domain
+DOMAIN_CONCURRENCY_LIMIT = 100
+
+_domain_limiters: dict = {}
+_domain_limiters_lock = threading.Lock()
+
+
+def get_domain_limiter(domain: str, max_concurrency: int = DOMAIN_CONCURRENCY_LIMIT) -> threading.BoundedSemaphore:
+  """Return the semaphore shared by every request sent to `domain` from this process"""
+  with _domain_limiters_lock:
+    if domain not in _domain_limiters:
+      _domain_limiters[domain] = threading.BoundedSemaphore(max_concurrency)
+    return _domain_limiters[domain]
+
 
 def default_backoff_handler(max_tries: int, factor: int, **kwargs):
   def log_retry_attempt(details):
@@ -30,17 +47,15 @@ def default_backoff_handler(max_tries: int, factor: int, **kwargs):
         f"Caught retryable error after {details['tries']} tries. Waiting {details['wait']} seconds then retrying...")
 
   def should_give_up(exc):
-    give_up = exc.response is not None and exc.response.status_code != codes.too_many_requests and 400 <= exc.response.status_code < 500
-
-    # Kintone can return an error with a limit using a 403 code error.
-    if exc.response is not None and exc.response.status_code == codes.forbidden:
-      error_data = exc.response.json()[0]
-      if error_data.get("errorCode", "") == "REQUEST_LIMIT_EXCEEDED":
-        give_up = True
+    # Connection errors and timeouts carry no response and are always retried
+    if exc.response is None:
+      return False
 
+    error = classify_error(exc.response)
+    give_up = error.category != RETRYABLE
     if give_up:
       logger.info(
-          f"Giving up for returned HTTP status: {exc.response.status_code}, body: {exc.response.text}")
+          f"Giving up for returned HTTP status: {exc.response.status_code}, category: {error.category}, body: {exc.response.text}")
     return give_up
 
   return backoff.on_exception(
@@ -0,0 +1,49 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+
+import argparse
+import json
+import pkgutil
+import sys
+from typing import List
+
+import yaml
+
+SPEC_COMMAND = "spec"
+PLAN_COMMAND = "plan"
+
+
+def print_spec() -> None:
+  """Print the SPEC message straight from spec.yaml, without importing the CDK or constructing the source"""
+  spec = yaml.safe_load(pkgutil.get_data("source_kintone", "spec.yaml"))
+  print(json.dumps({"type": "SPEC", "spec": spec}))
+
+
+def print_plan(args: List[str]) -> None:
+  """Dry run: print the estimated cost of a sync of every configured app, without reading any record"""
+  parser = argparse.ArgumentParser(prog=f"main.py {PLAN_COMMAND}")
+  parser.add_argument("--config", type=str, required=True, help="path to the json configuration file")
+  parsed_args = parser.parse_args(args)
+  with open(parsed_args.config) as config_file:
+    config = json.load(config_file)
+
+  from source_kintone.planner import format_plan, plan_sync
+  print(format_plan(plan_sync(config)))
+
+
+def run(args: List[str] = None) -> None:
+  args = sys.argv[1:] if args is None else args
+  if args[:1] == [SPEC_COMMAND]:
+    print_spec()
+    return
+  if args[:1] == [PLAN_COMMAND]:
+    print_plan(args[1:])
+    return
+
+  # The CDK and the HTTP stack are only needed by the commands that talk to kintone
+  from airbyte_cdk.entrypoint import launch
+
+  from source_kintone.source import SourceKintone
+  launch(SourceKintone(), args)
@@ -1,20 +1,33 @@
+import logging
 from abc import ABC
-from typing import (Any, Iterable, List, Mapping, MutableMapping, Optional,
-                    Tuple)
+from concurrent.futures import ThreadPoolExecutor
+from typing import (Any, Iterable, Iterator, List, Mapping, MutableMapping,
+                    Optional, Tuple, Union)
+from urllib.parse import urlparse
 
 import requests
+from airbyte_cdk.models import (AirbyteCatalog, AirbyteMessage,
+                                AirbyteStateMessage, ConfiguredAirbyteCatalog)
 from airbyte_cdk.sources import AbstractSource
 from airbyte_cdk.sources.streams import Stream
 
-from source_kintone.api import Kintone
-from source_kintone.auth import KintoneAuthenticator
-from source_kintone.streams import AppDetail
+from source_kintone.api import API_KEY_AUTHENTICATION, Kintone
+from source_kintone.auth import (KintoneApiTokenAuthenticator,
+                                 KintoneAuthenticator)
+from source_kintone.errors import AUTH, PERMISSION, QUOTA, classify_error
+from source_kintone.exceptions import KintoneException
+from source_kintone.utils import get_catalog_app_routes, group_api_tokens
+
+DISCOVER_PARALLEL_TASKS = 10
+DEFAULT_MEMORY_LIMIT_MB = 256
 
 
 # Source
 class SourceKintone(AbstractSource):
   def __init__(self, *args, **kwargs):
     super().__init__(*args, **kwargs)
+    # Routing tables read from the configured catalog, only set while reading
+    self._catalog_app_routes: Optional[Mapping[Optional[str], Mapping[str, Optional[str]]]] = None
 
   @staticmethod
   def _get_kintone_object(config: Mapping[str, Any]) -> Kintone:
@@ -22,8 +35,22 @@ class SourceKintone(AbstractSource):
     kintone.authentication()
     return kintone
 
+  def _get_app_routes(self, config: Mapping[str, Any]) -> Mapping[str, Optional[str]]:
+    # Discover saves the routes into the stream schemas, so read does not look them up again
+    if self._catalog_app_routes is not None and config["tenant"] in self._catalog_app_routes:
+      return self._catalog_app_routes[config["tenant"]]
+    return Kintone(**config).get_app_routes()
+
   @staticmethod
-  def _get_kintone_authenticator(config):
+  def _get_kintone_authenticator(config, app_id: str = None):
+    if config['auth_type'].get('option') == API_KEY_AUTHENTICATION:
+      # Each app only receives its own tokens
+      api_tokens = group_api_tokens(config['auth_type'].get('api_tokens')).get(app_id)
+      if not api_tokens:
+        raise Exception(
+            f"API token of app {app_id} is required")
+      return KintoneApiTokenAuthenticator(api_tokens=api_tokens)
+
     username = config['auth_type']['username']
     password = config['auth_type']['password']
     if not username or not password:
@@ -32,7 +59,25 @@ class SourceKintone(AbstractSource):
     auth = KintoneAuthenticator(username=username, password=password)
     return auth
 
-  def check_connection(self, logger, config) -> Tuple[bool, any]:
+  @staticmethod
+  def get_tenant_configs(config: Mapping[str, Any]) -> List[Mapping[str, Any]]:
+    """
+    The main domain of the config followed by every entry of `tenants`.
+    Entries only override the domain, app IDs and credentials, other options are shared.
+    Streams are namespaced by the host of their domain, so every host may only be configured once.
+    """
+    tenant_configs = [{**config, "tenant": None}]
+    hosts = {urlparse(config["domain"]).hostname}
+    for tenant in config.get("tenants") or []:
+      host = urlparse(tenant["domain"]).hostname
+      if host in hosts:
+        raise KintoneException(
+            f"ドメイン「{host}」が重複しています。同じドメインのアプリは1つの設定にまとめてください。")
+      hosts.add(host)
+      tenant_configs.append({**config, **tenant, "tenant": host})
+    return tenant_configs
+
+  def _check_tenant_connection(self, logger, config) -> Tuple[bool, any]:
     try:
       kintone_object = self._get_kintone_object(config)
       if kintone_object.authentication_error is not None:
@@ -40,24 +85,96 @@ class SourceKintone(AbstractSource):
         return False, kintone_object.authentication_error
       return True, None
     except requests.exceptions.HTTPError as error:
-      error_data = error.response.json()[0]
-      error_code = error_data.get("errorCode")
-      if error.response.status_code == requests.codes.FORBIDDEN and error_code == "REQUEST_LIMIT_EXCEEDED":
+      kintone_error = classify_error(error.response)
+      if kintone_error.category == QUOTA:
         logger.warn(
-            f"API Call limit is exceeded. Error message: '{error_data.get('message')}'")
+            f"API Call limit is exceeded. Error message: '{kintone_error.message}'")
         return False, "API Call limit is exceeded"
+      if kintone_error.category in (AUTH, PERMISSION):
+        return False, kintone_error.message
       return False, "System error"
 
+  def check_connection(self, logger, config) -> Tuple[bool, any]:
+    try:
+      tenant_configs = self.get_tenant_configs(config)
+    except KintoneException as error:
+      return False, str(error)
+    # Every domain is authenticated concurrently
+    with ThreadPoolExecutor(max_workers=len(tenant_configs)) as executor:
+      results = list(executor.map(
+          lambda tenant_config: self._check_tenant_connection(logger, tenant_config), tenant_configs))
+    for tenant_config, (connected, error) in zip(tenant_configs, results):
+      if not connected:
+        return False, f"{tenant_config['domain']}: {error}" if tenant_config["tenant"] else error
+    return True, None
+
+  def discover(self, logger: logging.Logger, config: Mapping[str, Any]) -> AirbyteCatalog:
+    # The schema of every app of every domain is read concurrently
+    streams = self.streams(config=config)
+    with ThreadPoolExecutor(max_workers=DISCOVER_PARALLEL_TASKS) as executor:
+      airbyte_streams = list(executor.map(lambda stream: stream.as_airbyte_stream(), streams))
+    return AirbyteCatalog(streams=airbyte_streams)
+
+  def read(
+      self,
+      logger: logging.Logger,
+      config: Mapping[str, Any],
+      catalog: ConfiguredAirbyteCatalog,
+      state: Optional[Union[List[AirbyteStateMessage], MutableMapping[str, Any]]] = None,
+  ) -> Iterator[AirbyteMessage]:
+    self._catalog_app_routes = get_catalog_app_routes(
+        (configured_stream.stream.namespace, configured_stream.stream.json_schema) for configured_stream in catalog.streams)
+    try:
+      yield from super().read(logger, config, catalog, state)
+    finally:
+      self._catalog_app_routes = None
+
   def streams(self, config: Mapping[str, Any]) -> List[Stream]:
-    auth = self._get_kintone_authenticator(config)
+    tenant_configs = self.get_tenant_configs(config)
+    with ThreadPoolExecutor(max_workers=len(tenant_configs)) as executor:
+      tenant_app_routes = list(executor.map(self._get_app_routes, tenant_configs))
+
+    streams: List[Stream] = []
+    for tenant_config, app_routes in zip(tenant_configs, tenant_app_routes):
+      streams.extend(self._get_tenant_streams(tenant_config, app_routes))
+    return streams
+
+  def _get_tenant_streams(self, config: Mapping[str, Any], app_routes: Mapping[str, Optional[str]]) -> List[Stream]:
+    # Stream modules are only needed by discover and read
+    from source_kintone.streams import (AppComments, AppDetail,
+                                        AppDetailChanges,
+                                        AppProcessManagement)
+
     domain: str = config.get('domain').rstrip(
         "/") if config.get('domain').endswith("/") else config.get('domain')
     app_ids = config.get('app_ids')
+    tenant = config.get('tenant')
     include_label = config.get('include_label')
+    include_comments = config.get('include_comments', False)
+    include_process_management = config.get('include_process_management', False)
+    app_detail_class = AppDetailChanges if config.get('detect_changes', False) else AppDetail
+    memory_limit = config.get('memory_limit_mb', DEFAULT_MEMORY_LIMIT_MB) * 1024 * 1024
     streams: List[Stream] = []
     for app_id in app_ids:
-      streams.append(AppDetail(authenticator=auth,
-                               domain=domain,
-                               app_id=app_id,
-                               include_label=include_label))
+      auth = self._get_kintone_authenticator(config, app_id)
+      guest_space_id = app_routes.get(app_id)
+      streams.append(app_detail_class(authenticator=auth,
+                                      domain=domain,
+                                      app_id=app_id,
+                                      include_label=include_label,
+                                      guest_space_id=guest_space_id,
+                                      memory_limit=memory_limit,
+                                      tenant=tenant))
+      if include_comments:
+        streams.append(AppComments(authenticator=auth,
+                                   domain=domain,
+                                   app_id=app_id,
+                                   guest_space_id=guest_space_id,
+                                   tenant=tenant))
+      if include_process_management:
+        streams.append(AppProcessManagement(authenticator=auth,
+                                            domain=domain,
+                                            app_id=app_id,
+                                            guest_space_id=guest_space_id,
+                                            tenant=tenant))
     return streams
@@ -0,0 +1,154 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+
+import codecs
+import json
+import mmap
+import tempfile
+from typing import Any, Iterable, Iterator, MutableMapping
+
+from source_kintone.exceptions import TmpFileIOError
+
+# Size of the pieces a page is downloaded, staged and decoded in
+STAGING_CHUNK_SIZE = 1024 * 1024
+
+
+class PageStagingBuffer:
+  """
+  Holds the body of one page in memory up to `memory_limit` bytes and spills the whole body to a temporary file past it.
+  Reading the buffer empties it: in-memory chunks are released as they are yielded,
+  then the staging file is memory-mapped and streamed back one chunk at a time.
+  """
+
+  def __init__(self, memory_limit: int, chunk_size: int = STAGING_CHUNK_SIZE):
+    self.memory_limit = memory_limit
+    self.chunk_size = chunk_size
+    self.size = 0
+    self._chunks = []
+    self._staging_file = None
+
+  @property
+  def spilled(self) -> bool:
+    return self._staging_file is not None
+
+  def write(self, chunk: bytes) -> None:
+    self.size += len(chunk)
+    if not self.spilled and self.size <= self.memory_limit:
+      self._chunks.append(chunk)
+      return
+
+    try:
+      if not self.spilled:
+        self._spill()
+      self._staging_file.write(chunk)
+    except OSError as err:
+      raise TmpFileIOError("Failed to spill the page to the staging file", str(err))
+
+  def _spill(self) -> None:
+    self._staging_file = tempfile.TemporaryFile(prefix="kintone_staging_")
+    for chunk in self._chunks:
+      self._staging_file.write(chunk)
+    self._chunks = []
+
+  def __iter__(self) -> Iterator[bytes]:
+    self._chunks.reverse()
+    while self._chunks:
+      yield self._chunks.pop()
+
+    if not self.spilled:
+      return
+    staging_file, self._staging_file = self._staging_file, None
+    try:
+      staging_file.flush()
+      with mmap.mmap(staging_file.fileno(), 0, access=mmap.ACCESS_READ) as staged_page:
+        for start in range(0, len(staged_page), self.chunk_size):
+          yield staged_page[start:start + self.chunk_size]
+    finally:
+      staging_file.close()
+
+  def close(self) -> None:
+    self._chunks = []
+    if self.spilled:
+      self._staging_file.close()
+      self._staging_file = None
+
+
+class _JsonChunkReader:
+  """Decodes the top level of a JSON object from UTF-8 chunks, keeping only the undecoded tail in memory"""
+
+  def __init__(self, chunks: Iterable[bytes]):
+    self._chunks = iter(chunks)
+    self._utf8 = codecs.getincrementaldecoder("utf-8")()
+    self._decoder = json.JSONDecoder()
+    self._text = ""
+    self._position = 0
+    self._exhausted = False
+
+  def _read_chunk(self) -> bool:
+    if self._exhausted:
+      return False
+    chunk = next(self._chunks, None)
+    self._exhausted = chunk is None
+    self._text = self._text[self._position:] + self._utf8.decode(chunk or b"", final=self._exhausted)
+    self._position = 0
+    return True
+
+  def peek(self) -> str:
+    """Next character that is not whitespace, without consuming it"""
+    while True:
+      while self._position < len(self._text) and self._text[self._position].isspace():
+        self._position += 1
+      if self._position < len(self._text):
+        return self._text[self._position]
+      if not self._read_chunk():
+        raise ValueError("Unexpected end of the JSON document")
+
+  def expect(self, characters: str) -> str:
+    character = self.peek()
+    if character not in characters:
+      raise ValueError(f"Expected one of {characters!r} in the JSON document, found {character!r}")
+    self._position += 1
+    return character
+
+  def value(self) -> Any:
+    self.peek()
+    while True:
+      try:
+        value, end = self._decoder.raw_decode(self._text, self._position)
+        # A number ending with the decoded text may continue in the next chunk
+        if end < len(self._text) or self._exhausted:
+          self._position = end
+          return value
+      except json.JSONDecodeError:
+        if self._exhausted:
+          raise
+      self._read_chunk()
+
+
+def iter_json_array(chunks: Iterable[bytes], key: str, other_values: MutableMapping[str, Any]) -> Iterator[Any]:
+  """
+  Yield the items of the array `key` of a JSON object one at a time, eg: the records of a records.json response.
+  The other members of the object are stored in `other_values` as they are read.
+  """
+  reader = _JsonChunkReader(chunks)
+  reader.expect("{")
+  if reader.peek() == "}":
+    return
+  while True:
+    member = reader.value()
+    reader.expect(":")
+    if member == key:
+      reader.expect("[")
+      if reader.peek() == "]":
+        reader.expect("]")
+      else:
+        while True:
+          yield reader.value()
+          if reader.expect(",]") == "]":
+            break
+    else:
+      other_values[member] = reader.value()
+    if reader.expect(",}") == "}":
+      return
@@ -1,22 +1,59 @@
-from abc import ABC
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 from typing import (Any, Iterable, List, Mapping, MutableMapping, Optional,
                     Tuple)
 
 import requests
+from airbyte_cdk.models import SyncMode
+from airbyte_cdk.sources.streams import IncrementalMixin
 from airbyte_cdk.sources.streams.http import HttpStream
 
+from source_kintone.api import get_shared_adapter
 from source_kintone.auth import KintoneAuthenticator
+from source_kintone.errors import RETRYABLE, classify_error
 from source_kintone.mapping import KINTONE_TO_AIRBYTE_MAPPING
-from source_kintone.utils import generate_mapping_result
+from source_kintone.rate_limiting import (default_backoff_handler,
+                                          get_domain_limiter)
+from source_kintone.staging import PageStagingBuffer, iter_json_array
+from source_kintone.utils import (PackedFingerprints, build_api_url,
+                                  decode_fingerprints, encode_fingerprints,
+                                  generate_mapping_result, get_route_schema,
+                                  hash_record, resolve_field_labels)
 
 EXCLUDED_FIELDS = ["GROUP", "LABEL", "BLANK_SPACE", "REFERENCE_TABLE"]
 
+# Memory available to the records of one stream, overridden by `memory_limit_mb`
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# Default code of the "Updated datetime" field, used when the app schema does not expose it
+DEFAULT_UPDATED_TIME_CODE = "更新日時"
+
 # Basic full refresh stream
 
 
 class KintoneStream(HttpStream, ABC):
   url_base = ""
 
+  def __init__(self, tenant: Optional[str] = None, **kwargs):
+    super().__init__(**kwargs)
+    # Streams of additional domains are namespaced and prefixed by the domain host
+    self.tenant = tenant
+    self._session.mount("https://", get_shared_adapter())
+
+  @property
+  def namespace(self) -> Optional[str]:
+    return self.tenant
+
+  @property
+  def name_prefix(self) -> str:
+    return f"{self.tenant}__" if self.tenant else ""
+
+  def _send(self, request: requests.PreparedRequest, request_kwargs: Mapping[str, Any]) -> requests.Response:
+    # Every request to a domain, from any stream or thread, counts towards the limit of that domain
+    with get_domain_limiter(urlparse(request.url).netloc):
+      return super()._send(request, request_kwargs)
+
   @property
   def authenticator(self) -> KintoneAuthenticator:
     return self._session.auth
@@ -33,18 +70,69 @@ class KintoneStream(HttpStream, ABC):
   def parse_response(self, response: requests.Response, **kwargs) -> Iterable[Mapping]:
     yield {}
 
+  def should_retry(self, response: requests.Response) -> bool:
+    if response.status_code < requests.codes.bad_request:
+      return False
+    return classify_error(response).category == RETRYABLE
+
+  def get_error_display_message(self, exception: BaseException) -> Optional[str]:
+    if isinstance(exception, requests.exceptions.HTTPError):
+      return classify_error(exception.response).message
+    return super().get_error_display_message(exception)
+
+
+class IncrementalKintoneStream(KintoneStream, IncrementalMixin, ABC):
+  state_checkpoint_interval = None
+
+  def __init__(self, **kwargs):
+    super().__init__(**kwargs)
+    self._state = {}
+
+  @property
+  def cursor_field(self) -> str:
+    return "record_updated_time"
+
+  @property
+  def state(self) -> MutableMapping[str, Any]:
+    return self._state
+
+  @state.setter
+  def state(self, value: MutableMapping[str, Any]):
+    self._state = dict(value or {})
+
+  def read_records(
+      self,
+      sync_mode: SyncMode,
+      cursor_field: List[str] = None,
+      stream_slice: Mapping[str, Any] = None,
+      stream_state: Mapping[str, Any] = None,
+  ) -> Iterable[Mapping[str, Any]]:
+    # The CDK passes the saved state in every sync mode, but a full refresh replaces the table with every record
+    if sync_mode != SyncMode.incremental:
+      stream_state = {}
+    # Records are not read in cursor order, so the state keeps the running maximum of the cursor.
+    # The state is replaced rather than updated, the requests of this read keep filtering on the incoming cursor.
+    for record in super().read_records(
+        sync_mode=sync_mode, cursor_field=cursor_field, stream_slice=stream_slice, stream_state=stream_state):
+      # kintone datetimes are ISO 8601 strings in UTC, so they compare lexicographically
+      latest_cursor = record.get(self.cursor_field) or ""
+      if latest_cursor > (self._state.get(self.cursor_field) or ""):
+        self._state = {**self._state, self.cursor_field: latest_cursor}
+      yield record
+
 
 class AppSchema(KintoneStream):
   primary_key = None
 
-  def __init__(self, domain: str, app_id: str, include_label: bool, ** kwargs):
+  def __init__(self, domain: str, app_id: str, include_label: bool, guest_space_id: Optional[str] = None, ** kwargs):
     super().__init__(**kwargs)
     self.domain = domain
     self.app_id = app_id
     self.include_label = include_label
+    self.guest_space_id = guest_space_id
 
   def path(self, **kwargs) -> str:
-    return f"{self.domain}/k/v1/app/form/fields.json?app={self.app_id}&lang=ja"
+    return build_api_url(self.domain, f"app/form/fields.json?app={self.app_id}&lang=ja", self.guest_space_id)
 
   def parse_response(self, response: requests.Response, **kwargs) -> Iterable[Mapping]:
     app_schema: dict = response.json()['properties']
@@ -58,9 +146,13 @@ class AppSchema(KintoneStream):
         key: value for key, value in app_schema.items() if is_valid_property(value)
     }
 
+    # Resolve the labels of the whole app at once, so that duplicated labels never overwrite each other
+    field_names = resolve_field_labels(
+        {key: value['label'] for key, value in filter_app_schema.items()}) if self.include_label else {}
+
     for key, value in filter_app_schema.items():
       try:
-        field_name = value['label'] if self.include_label else key
+        field_name = field_names.get(key, key)
         field_type = value['type']
         field_schema = {
             field_name: {
@@ -79,33 +171,45 @@ class AppDetail(KintoneStream):
   http_method = "GET"
   primary_key = None
   page_size = 500
+  # Share of the memory limit the body of a page may take before it spills to the staging file
+  page_memory_ratio = 0.25
 
-  def __init__(self, domain: str, app_id: str, include_label: bool, ** kwargs):
+  def __init__(self, domain: str, app_id: str, include_label: bool, guest_space_id: Optional[str] = None,
+               memory_limit: int = DEFAULT_MEMORY_LIMIT, ** kwargs):
     super().__init__(**kwargs)
     self.domain = domain
     self.app_id = app_id
     self.include_label = include_label
+    self.guest_space_id = guest_space_id
+    self.memory_limit = memory_limit
     self.current_offset = 0
+    self.page_size = AppDetail.page_size
+    self._next_page_size = self.page_size
+    self._total_count = None
+    self._app_schema = None
+    self._mapping_dict = None
 
   @property
   def name(self) -> str:
-    return f"APP_{self.app_id}"
+    return f"{self.name_prefix}APP_{self.app_id}"
 
   def path(self, **kwargs) -> str:
-    return f"{self.domain}/k/v1/records.json?app={self.app_id}&totalCount=true"
+    return build_api_url(self.domain, f"records.json?app={self.app_id}&totalCount=true", self.guest_space_id)
 
   def next_page_token(self, response: requests.Response) -> Mapping[str, Any]:
     offset = 0
-    total_records = int(response.json()['totalCount'])
+    total_records = self._total_count if self._total_count is not None else int(response.json()['totalCount'])
 
     # Assign offset value on every stream read
-    if total_records - self.current_offset > AppDetail.page_size:
-      offset = self.current_offset + AppDetail.page_size
-      self.current_offset += AppDetail.page_size
-      return {"query": f"limit {AppDetail.page_size} offset {offset}"}
+    if total_records - self.current_offset > self.page_size:
+      offset = self.current_offset + self.page_size
+      self.current_offset += self.page_size
+      # The page size chosen while parsing only applies once the offset of the page just read is advanced
+      self.page_size = self._next_page_size
+      return {"query": f"limit {self.page_size} offset {offset}"}
 
     # Last stream read
-    elif total_records - self.current_offset < AppDetail.page_size:
+    elif total_records - self.current_offset < self.page_size:
       return {}
 
   def request_params(
@@ -119,78 +223,349 @@ class AppDetail(KintoneStream):
     # Handle pagination by inserting the next page's token in the request parameters
     # First stream read
     if self.current_offset == 0:
-      params.update({"query": f"limit {AppDetail.page_size} offset 0"})
+      params.update({"query": f"limit {self.page_size} offset 0"})
     else:
       if next_page_token:
         params.update(next_page_token)
       # Final stream read, next_page_token is None
       params.update(
-          {"query": f"limit {AppDetail.page_size} offset {self.current_offset}"})
+          {"query": f"limit {self.page_size} offset {self.current_offset}"})
     return params
 
-  def parse_response(self, response: requests.Response, **kwargs) -> Iterable[Mapping]:
-    mapping_dict = {}
-    app_records = response.json()['records']
-    total_count = response.json()['totalCount']
-    print(
-        f"From kintone: APP_{self.app_id} has {len(app_records)} records during this read")
-    print(f"From kintone: Count {total_count} records from APP_{self.app_id}")
-    print(f"Current offset: {self.current_offset}")
-
-    if not self.include_label:
-      app_records_generator = generate_mapping_result(
-          raw_data=app_records)
-    else:
+  @property
+  def app_schema(self) -> Mapping[str, Any]:
+    """JSON Schema properties of the app, read once per stream and shared by discover and read"""
+    if self._app_schema is None:
       app_schema_stream = AppSchema(
           authenticator=self.authenticator,
           domain=self.domain,
           app_id=self.app_id,
-          include_label=self.include_label)
+          include_label=self.include_label,
+          guest_space_id=self.guest_space_id
+      )
       app_schema_records = app_schema_stream.read_records(
           sync_mode="full_refresh")
+
+      # Each record corresponds to a property in the JSON Schema
+      # Loop over each of these properties and add it to the JSON Schema
       default_schema = {
           "$id": {"type": ["null", "integer"], "data_label": "$id"},
           "$revision": {"type": ["null", "integer"], "data_label": "$revision"},
       }
       for schema_property in app_schema_records:
         default_schema.update(schema_property)
-      for key, value in default_schema.items():
-        # Eg: mapping_dict = {
-        #   "SalesCategoryDetails": "売上区分詳細"
-        # }
-        mapping_dict[value["data_label"]] = key
-      app_records_generator = generate_mapping_result(
-          raw_data=app_records,
-          mapping_dict=mapping_dict,
-          include_label=True)
-
-    # Finally, convert the generator to a list
-    records_response = list(app_records_generator)
+      self._app_schema = default_schema
+    return self._app_schema
+
+  @property
+  def mapping_dict(self) -> Mapping[str, str]:
+    """Field code to column name mapping resolved from the cached schema"""
+    if self._mapping_dict is None:
+      # Eg: mapping_dict = {
+      #   "SalesCategoryDetails": "売上区分詳細"
+      # }
+      self._mapping_dict = {value["data_label"]: key for key, value in self.app_schema.items()}
+    return self._mapping_dict
+
+  def _limit_page_size(self, page_bytes: int, page_records: int) -> None:
+    """Shrink the following pages when a page spilled past its share of the memory limit"""
+    page_memory_limit = self.memory_limit * self.page_memory_ratio
+    if page_bytes <= page_memory_limit or page_records == 0:
+      return
+    record_bytes = page_bytes / page_records
+    self._next_page_size = max(1, min(self.page_size, int(page_memory_limit // record_bytes)))
+    self.logger.info(
+        f"APP_{self.app_id}: a page of {page_records} records takes {page_bytes} bytes, reading {self._next_page_size} records per page")
+
+  def request_kwargs(self, *args, **kwargs) -> Mapping[str, Any]:
+    # The body is staged by parse_response, instead of being loaded whole by requests
+    return {"stream": True}
+
+  def parse_response(self, response: requests.Response, **kwargs) -> Iterable[Mapping]:
+    page = PageStagingBuffer(int(self.memory_limit * self.page_memory_ratio))
+    page_values = {}
+    page_records = 0
+    try:
+      for chunk in response.iter_content(chunk_size=page.chunk_size):
+        page.write(chunk)
+
+      # Records are decoded one at a time and released as soon as they are mapped
+      app_records = iter_json_array(page, "records", page_values)
+      if not self.include_label:
+        app_records_generator = generate_mapping_result(
+            raw_data=app_records)
+      else:
+        app_records_generator = generate_mapping_result(
+            raw_data=app_records,
+            mapping_dict=self.mapping_dict,
+            include_label=True)
+      for record in app_records_generator:
+        page_records += 1
+        yield record
+    finally:
+      page.close()
+
+    total_count = page_values['totalCount']
+    self._total_count = int(total_count)
+    self._limit_page_size(page.size, page_records)
     print(
-        f"From Airbyte: Read from APP_{self.app_id} with {len(records_response)} records")
-    yield from records_response
+        f"From kintone: APP_{self.app_id} has {page_records} records during this read")
+    print(f"From kintone: Count {total_count} records from APP_{self.app_id}")
+    print(f"Current offset: {self.current_offset}")
 
   def get_json_schema(self) -> Mapping[str, Any]:
-    app_schema_stream = AppSchema(
-        authenticator=self.authenticator,
-        domain=self.domain,
-        app_id=self.app_id,
-        include_label=self.include_label
-    )
-    app_schema_records = app_schema_stream.read_records(
-        sync_mode="full_refresh")
-
-    # Each record corresponds to a property in the JSON Schema
-    # Loop over each of these properties and add it to the JSON Schema
-    default_schema = {
-        "$id": {"type": ["null", "integer"], "data_label": "$id"},
-        "$revision": {"type": ["null", "integer"], "data_label": "$revision"},
+    return {
+        "$schema": "http://json-schema.org/draft-07/schema#",
+        "additionalProperties": True,
+        "type": "object",
+        "properties": self.app_schema,
+        **get_route_schema(self.app_id, self.guest_space_id),
     }
-    for schema_property in app_schema_records:
-      default_schema.update(schema_property)
+
+
+class AppDetailChanges(AppDetail, IncrementalMixin):
+  """
+  Reads the whole app like AppDetail, but only emits the records that are new or changed since the previous sync.
+  Records are compared by `$revision` and by a hash of their content, since CALC fields can change without a new revision.
+  The state holds the fingerprints of every record of the app, packed by `encode_fingerprints`.
+  """
+  cursor_field = "$revision"
+  # Each change emits a new version of the record, `$id` keeps its name in label mode too
+  primary_key = "$id"
+
+  def __init__(self, **kwargs):
+    super().__init__(**kwargs)
+    self._state = {}
+    self._skip_unchanged = True
+    self._previous_fingerprints = PackedFingerprints()
+    self._fingerprints = PackedFingerprints()
+    self._read_completed = False
+    self.changed_records = 0
+    self.unchanged_records = 0
+
+  @property
+  def state(self) -> MutableMapping[str, Any]:
+    if not self._read_completed:
+      return self._state
+    return {"fingerprints": encode_fingerprints(self._fingerprints)}
+
+  @state.setter
+  def state(self, value: MutableMapping[str, Any]):
+    self._state = value or {}
+    self._previous_fingerprints = decode_fingerprints(self._state.get("fingerprints"))
+
+  def read_records(self, sync_mode: SyncMode, *args, **kwargs) -> Iterable[Mapping[str, Any]]:
+    self._fingerprints = PackedFingerprints()
+    self._read_completed = False
+    # The CDK sets the saved state in every sync mode, but a full refresh replaces the table and needs every record
+    self._skip_unchanged = sync_mode == SyncMode.incremental
+    self.changed_records = 0
+    self.unchanged_records = 0
+    yield from super().read_records(sync_mode, *args, **kwargs)
+    self._read_completed = True
+    self.logger.info(
+        f"APP_{self.app_id}: {self.changed_records} new or changed records, {self.unchanged_records} unchanged records "
+        f"{'skipped' if self._skip_unchanged else 'emitted'}")
+
+  def parse_response(self, response: requests.Response, **kwargs) -> Iterable[Mapping]:
+    for record in super().parse_response(response, **kwargs):
+      record_id = int(record["$id"])
+      fingerprint = (int(record["$revision"]), hash_record(record))
+      # Fingerprints are rebuilt in every sync mode, so the next incremental read compares against this one
+      self._fingerprints.add(record_id, *fingerprint)
+      if self._previous_fingerprints.get(record_id) == fingerprint:
+        self.unchanged_records += 1
+        if self._skip_unchanged:
+          continue
+      else:
+        self.changed_records += 1
+      yield record
+
+class AppRecordActivity(IncrementalKintoneStream, ABC):
+  """
+  Base class of the per-app child streams.
+  Walks the records updated since the last sync in batches of `page_size`, requesting only the fields
+  the child stream needs, and pages with `$id` so that every batch costs a single request.
+  """
+  http_method = "GET"
+  primary_key = None
+  page_size = 500
+
+  def __init__(self, domain: str, app_id: str, guest_space_id: Optional[str] = None, **kwargs):
+    super().__init__(**kwargs)
+    self.domain = domain
+    self.app_id = app_id
+    self.guest_space_id = guest_space_id
+    self._field_codes = None
+
+  def path(self, **kwargs) -> str:
+    return build_api_url(self.domain, "records.json", self.guest_space_id)
+
+  @property
+  def field_codes(self) -> Mapping[str, str]:
+    """Codes of the enabled fields of the app keyed by kintone field type, fetched once per stream"""
+    if self._field_codes is None:
+      properties = self._get_json(
+          build_api_url(self.domain, "app/form/fields.json", self.guest_space_id), params={"app": self.app_id})["properties"]
+      self._field_codes = {
+          value["type"]: key for key, value in properties.items() if value.get("enabled", True)
+      }
+    return self._field_codes
+
+  @property
+  def updated_time_code(self) -> str:
+    return self.field_codes.get("UPDATED_TIME", DEFAULT_UPDATED_TIME_CODE)
+
+  @abstractmethod
+  def activity_fields(self) -> List[str]:
+    """Field codes requested on top of `$id` and the updated datetime"""
+
+  @default_backoff_handler(max_tries=5, factor=5)
+  def _get_json(self, url: str, params: Mapping[str, Any] = None) -> Mapping[str, Any]:
+    with get_domain_limiter(urlparse(url).netloc):
+      response = self._session.get(url, params=params)
+    response.raise_for_status()
+    return response.json()
+
+  def next_page_token(self, response: requests.Response) -> Optional[Mapping[str, Any]]:
+    records = response.json()["records"]
+    if len(records) < self.page_size:
+      return None
+    return {"last_id": records[-1]["$id"]["value"]}
+
+  def request_params(
+      self,
+      stream_state: Mapping[str, Any],
+      stream_slice: Mapping[str, Any] = None,
+      next_page_token: Mapping[str, Any] = None,
+  ) -> MutableMapping[str, Any]:
+    conditions = []
+    cursor = (stream_state or {}).get(self.cursor_field)
+    if cursor:
+      # Updated datetimes only have minute precision, records updated later in the cursor minute are read again
+      # and deduplicated by the primary key
+      conditions.append(f'{self.updated_time_code} >= "{cursor}"')
+    if next_page_token:
+      conditions.append(f"$id > {next_page_token['last_id']}")
+    query = " and ".join(conditions)
+    params = {
+        "app": self.app_id,
+        "query": f"{query} order by $id asc limit {self.page_size}".strip(),
+    }
+    for index, field_code in enumerate(["$id", self.updated_time_code, *self.activity_fields()]):
+      params[f"fields[{index}]"] = field_code
+    return params
+
+  def _record_updated_time(self, record: Mapping[str, Any]) -> str:
+    return record[self.updated_time_code]["value"]
+
+
+class AppComments(AppRecordActivity):
+  """Comments of the records updated since the last sync, fetched concurrently under the domain limiter"""
+  # Every comment of an updated record is read again, destinations deduplicate them with this key
+  primary_key = ["record_id", "comment_id"]
+  comments_page_size = 10
+  parallel_tasks_size = 10
+
+  @property
+  def name(self) -> str:
+    return f"{self.name_prefix}APP_{self.app_id}_COMMENTS"
+
+  def activity_fields(self) -> List[str]:
+    return []
+
+  def _read_record_comments(self, record: Mapping[str, Any]) -> List[Mapping[str, Any]]:
+    record_id = int(record["$id"]["value"])
+    record_updated_time = self._record_updated_time(record)
+    comments = []
+    offset = 0
+    while True:
+      response_json = self._get_json(
+          build_api_url(self.domain, "record/comments.json", self.guest_space_id),
+          params={"app": self.app_id, "record": record_id, "order": "desc",
+                  "offset": offset, "limit": self.comments_page_size})
+      for comment in response_json["comments"]:
+        comments.append({
+            "record_id": record_id,
+            "comment_id": int(comment["id"]),
+            "text": comment.get("text"),
+            "created_at": comment.get("createdAt"),
+            "creator": comment.get("creator"),
+            "mentions": comment.get("mentions", []),
+            "record_updated_time": record_updated_time,
+        })
+      # `older` tells whether more comments exist past this page when ordering by descending date
+      if not response_json.get("older"):
+        return comments
+      offset += self.comments_page_size
+
+  def parse_response(self, response: requests.Response, **kwargs) -> Iterable[Mapping]:
+    records = response.json()["records"]
+    with ThreadPoolExecutor(max_workers=self.parallel_tasks_size) as executor:
+      futures = [executor.submit(self._read_record_comments, record) for record in records]
+      for future in futures:
+        yield from future.result()
+
+  def get_json_schema(self) -> Mapping[str, Any]:
+    return {
+        "$schema": "http://json-schema.org/draft-07/schema#",
+        "additionalProperties": True,
+        "type": "object",
+        "properties": {
+            "record_id": {"type": ["null", "integer"]},
+            "comment_id": {"type": ["null", "integer"]},
+            "text": {"type": ["null", "string"]},
+            "created_at": KINTONE_TO_AIRBYTE_MAPPING["CREATED_TIME"],
+            "creator": KINTONE_TO_AIRBYTE_MAPPING["CREATOR"],
+            "mentions": {"type": ["null", "array"], "items": {"type": ["null", "object"], "additionalProperties": True}},
+            "record_updated_time": KINTONE_TO_AIRBYTE_MAPPING["UPDATED_TIME"],
+        },
+        **get_route_schema(self.app_id, self.guest_space_id),
+    }
+
+
+class AppProcessManagement(AppRecordActivity):
+  """
+  Process management status of the records updated since the last sync.
+  Read incrementally in append mode, each sync adds the latest status of every changed record to its history.
+  """
+  # A record re-read within the minute of the cursor yields the same status snapshot again
+  primary_key = ["record_id", "record_updated_time"]
+
+  @property
+  def name(self) -> str:
+    return f"{self.name_prefix}APP_{self.app_id}_STATUS"
+
+  def activity_fields(self) -> List[str]:
+    return [self.field_codes["STATUS"], self.field_codes["STATUS_ASSIGNEE"]]
+
+  def read_records(self, *args, **kwargs) -> Iterable[Mapping[str, Any]]:
+    if "STATUS" not in self.field_codes:
+      self.logger.info(f"Process management is not enabled in APP_{self.app_id}")
+      return
+    yield from super().read_records(*args, **kwargs)
+
+  def parse_response(self, response: requests.Response, **kwargs) -> Iterable[Mapping]:
+    status_code = self.field_codes["STATUS"]
+    assignee_code = self.field_codes["STATUS_ASSIGNEE"]
+    for record in response.json()["records"]:
+      yield {
+          "record_id": int(record["$id"]["value"]),
+          "status": record[status_code]["value"],
+          "assignee": record[assignee_code]["value"],
+          "record_updated_time": self._record_updated_time(record),
+      }
+
+  def get_json_schema(self) -> Mapping[str, Any]:
     return {
         "$schema": "http://json-schema.org/draft-07/schema#",
         "additionalProperties": True,
         "type": "object",
-        "properties": default_schema,
+        "properties": {
+            "record_id": {"type": ["null", "integer"]},
+            "status": KINTONE_TO_AIRBYTE_MAPPING["STATUS"],
+            "assignee": {"type": ["null", "array"], "items": {"type": ["null", "object"], "additionalProperties": True}},
+            "record_updated_time": KINTONE_TO_AIRBYTE_MAPPING["UPDATED_TIME"],
+        },
+        **get_route_schema(self.app_id, self.guest_space_id),
     }
@@ -1,4 +1,14 @@
 import base64
+import hashlib
+import json
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate, chain
+from typing import Any, Iterable, List, Mapping, Optional, Tuple
 
 
 def encode_to_base64(string):
@@ -6,14 +16,201 @@ def encode_to_base64(string):
   return encoded_string.decode('utf-8')
 
 
+# kintone accepts at most 9 comma separated API tokens in one X-Cybozu-API-Token header
+MAX_API_TOKENS_PER_REQUEST = 9
+
+
+def group_api_tokens(api_tokens: Iterable[Mapping[str, str]]) -> dict:
+  """
+  Group the configured API tokens by app ID, eg: [{"app_id": "1", "token": "a,b"}] -> {"1": ["a", "b"]}.
+  An app may hold several tokens, eg: the tokens of the apps its lookup fields copy from.
+  """
+  grouped = {}
+  for api_token in api_tokens or []:
+    tokens = grouped.setdefault(api_token["app_id"], [])
+    for token in api_token["token"].split(","):
+      token = token.strip()
+      if token and token not in tokens:
+        tokens.append(token)
+  return grouped
+
+
+def join_api_tokens(api_tokens: Mapping[str, List[str]], app_ids: Iterable[str]) -> str:
+  """Value of the X-Cybozu-API-Token header covering every app of `app_ids`"""
+  tokens = []
+  for app_id in app_ids:
+    for token in api_tokens.get(app_id, []):
+      if token not in tokens:
+        tokens.append(token)
+  return ",".join(tokens)
+
+
+def batch_apps_by_tokens(api_tokens: Mapping[str, List[str]], app_ids: List[str], max_apps: int) -> List[List[str]]:
+  """Pack the apps into as few requests as the header limit allows, each batch needing at most 9 tokens"""
+  batches = []
+  batch, batch_tokens = [], set()
+  for app_id in app_ids:
+    app_tokens = set(api_tokens.get(app_id, []))
+    if batch and (len(batch_tokens | app_tokens) > MAX_API_TOKENS_PER_REQUEST or len(batch) == max_apps):
+      batches.append(batch)
+      batch, batch_tokens = [], set()
+    batch.append(app_id)
+    batch_tokens |= app_tokens
+  if batch:
+    batches.append(batch)
+  return batches
+
+
+def build_api_url(domain: str, path: str, guest_space_id: Optional[str] = None) -> str:
+  """Apps in a guest space are only reachable under /k/guest/{spaceId}/v1"""
+  if guest_space_id:
+    return f"{domain}/k/guest/{guest_space_id}/v1/{path}"
+  return f"{domain}/k/v1/{path}"
+
+
+# Keys of the stream schemas that carry the route of their app from discover to read
+APP_ID_SCHEMA_KEY = "kintone_app_id"
+GUEST_SPACE_ID_SCHEMA_KEY = "kintone_guest_space_id"
+
+
+def get_route_schema(app_id: str, guest_space_id: Optional[str]) -> Mapping[str, Any]:
+  return {APP_ID_SCHEMA_KEY: app_id, GUEST_SPACE_ID_SCHEMA_KEY: guest_space_id}
+
+
+def get_catalog_app_routes(json_schemas: Iterable[Tuple[Optional[str], Mapping[str, Any]]]) -> dict:
+  """
+  Routing tables saved in the configured catalog, by namespace: {namespace: {app ID: guest space ID}}.
+  Streams discovered before the routes were saved into their schema are left out.
+  """
+  catalog_app_routes = {}
+  for namespace, json_schema in json_schemas:
+    if APP_ID_SCHEMA_KEY in json_schema:
+      catalog_app_routes.setdefault(namespace, {})[json_schema[APP_ID_SCHEMA_KEY]] = json_schema.get(GUEST_SPACE_ID_SCHEMA_KEY)
+  return catalog_app_routes
+
+
+def resolve_field_labels(field_labels: Mapping[str, str]) -> dict:
+  """
+  Map each field code to a unique column name based on its label.
+  Fields sharing a label are disambiguated by appending their field code, eg: "金額_price"
+  """
+  label_counts = Counter(field_labels.values())
+  resolved = {}
+  used_names = {label for label, count in label_counts.items() if count == 1}
+  for code in sorted(field_labels):
+    label = field_labels[code]
+    if label_counts[label] == 1:
+      resolved[code] = label
+      continue
+    name = f"{label}_{code}"
+    # The suffixed name may itself be the label of another field
+    while name in used_names:
+      name = f"{name}_{code}"
+    used_names.add(name)
+    resolved[code] = name
+  return resolved
+
+
 def generate_mapping_result(raw_data, mapping_dict: dict = None, include_label=False):
   if not include_label:
     for item in raw_data:
       yield {key: value["value"] for key, value in item.items()}
   else:
     for item in raw_data:
-      final = {}
-      for mapping_key, mapping_value in mapping_dict.items():
-        final.update(
-            {mapping_value: item[mapping_key]["value"]})
-      yield final
+      yield {mapping_dict[key]: value["value"] for key, value in item.items() if key in mapping_dict}
+
+
+# Size of the content hash of a record, it fits in one unsigned 64 bits integer
+HASH_SIZE = 8
+
+
+def hash_record(record: Mapping[str, Any]) -> bytes:
+  """8 bytes content hash of a mapped record, independent of the key order"""
+  return hashlib.blake2b(json.dumps(record, sort_keys=True, ensure_ascii=False).encode('utf-8'), digest_size=HASH_SIZE).digest()
+
+
+class PackedFingerprints:
+  """
+  `$id -> ($revision, content hash)` map held in three flat 64 bits arrays, 24 bytes per record
+  where a dict of tuples takes over 200 bytes, eg: 24 MB for a million records.
+  Lookups bisect the record IDs, so they only find the records added before the last `sort`.
+  """
+
+  def __init__(self, record_ids: array = None, revisions: array = None, hashes: array = None):
+    self.record_ids = record_ids if record_ids is not None else array("Q")
+    self.revisions = revisions if revisions is not None else array("Q")
+    # Content hashes are stored as little endian integers, so they pack as the raw hash bytes
+    self.hashes = hashes if hashes is not None else array("Q")
+
+  def __len__(self) -> int:
+    return len(self.record_ids)
+
+  def add(self, record_id: int, revision: int, content_hash: bytes) -> None:
+    self.record_ids.append(record_id)
+    self.revisions.append(revision)
+    self.hashes.append(int.from_bytes(content_hash, "little"))
+
+  def get(self, record_id: int) -> Optional[Tuple[int, bytes]]:
+    index = bisect_left(self.record_ids, record_id)
+    if index == len(self.record_ids) or self.record_ids[index] != record_id:
+      return None
+    return self.revisions[index], self.hashes[index].to_bytes(HASH_SIZE, "little")
+
+  def sort(self) -> None:
+    """Sort by record ID. kintone returns records by descending `$id` by default, which only needs a reverse."""
+    record_ids = self.record_ids
+    if all(record_ids[index] <= record_ids[index + 1] for index in range(len(record_ids) - 1)):
+      return
+    if all(record_ids[index] > record_ids[index + 1] for index in range(len(record_ids) - 1)):
+      for values in (self.record_ids, self.revisions, self.hashes):
+        values.reverse()
+      return
+    order = sorted(range(len(record_ids)), key=record_ids.__getitem__)
+    self.record_ids = array("Q", (self.record_ids[index] for index in order))
+    self.revisions = array("Q", (self.revisions[index] for index in order))
+    self.hashes = array("Q", (self.hashes[index] for index in order))
+
+
+def _to_little_endian(values: array) -> bytes:
+  if sys.byteorder == "big":
+    values = array(values.typecode, values)
+    values.byteswap()
+  return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+  values = array(typecode)
+  values.frombytes(data)
+  if sys.byteorder == "big":
+    values.byteswap()
+  return values
+
+
+def encode_fingerprints(fingerprints: PackedFingerprints) -> str:
+  """
+  Pack the fingerprints into a compressed string for the stream state.
+  Record IDs are sorted and delta encoded, so the IDs and revisions compress to a few bits per record
+  and the encoded state stays around 11 bytes per record, eg: about 11 MB for a million records.
+  """
+  fingerprints.sort()
+  record_ids = fingerprints.record_ids
+  id_deltas = array("Q", (current - previous for previous, current in zip(chain([0], record_ids), record_ids)))
+  payload = (struct.pack("<I", len(record_ids)) + _to_little_endian(id_deltas)
+             + _to_little_endian(fingerprints.revisions) + _to_little_endian(fingerprints.hashes))
+  return base64.b64encode(zlib.compress(payload, 9)).decode('utf-8')
+
+
+def decode_fingerprints(encoded: Optional[str]) -> PackedFingerprints:
+  """Unpack the fingerprints of the stream state, already sorted by record ID"""
+  if not encoded:
+    return PackedFingerprints()
+  # Sliced through a memoryview, so the arrays are filled without copying the payload again
+  payload = memoryview(zlib.decompress(base64.b64decode(encoded)))
+  (count,) = struct.unpack_from("<I", payload)
+  offset = struct.calcsize("<I")
+  id_deltas = _from_little_endian("Q", payload[offset:offset + count * 8])
+  offset += count * 8
+  revisions = _from_little_endian("Q", payload[offset:offset + count * 8])
+  offset += count * 8
+  hashes = _from_little_endian("Q", payload[offset:offset + count * HASH_SIZE])
+  return PackedFingerprints(array("Q", accumulate(id_deltas)), revisions, hashes)
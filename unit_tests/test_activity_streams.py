@@ -0,0 +1,110 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+from typing import Mapping
+from unittest.mock import MagicMock, patch
+from urllib.parse import unquote_plus
+
+import pytest
+from airbyte_cdk.models import SyncMode
+from source_kintone.auth import KintoneAuthenticator
+from source_kintone.streams import AppComments, AppProcessManagement
+
+FIELD_CODES = {"UPDATED_TIME": "更新日時", "STATUS": "ステータス", "STATUS_ASSIGNEE": "作業者"}
+
+
+@pytest.fixture
+def comments_stream(mocker):
+    stream = AppComments(domain="https://sample.cybozu.com", app_id="1")
+    stream._field_codes = FIELD_CODES
+    return stream
+
+
+def test_request_params_filters_by_cursor_and_last_id(comments_stream):
+    params = comments_stream.request_params(
+        stream_state={"record_updated_time": "2023-01-01T00:00:00Z"},
+        next_page_token={"last_id": "500"})
+    assert params["query"] == '更新日時 >= "2023-01-01T00:00:00Z" and $id > 500 order by $id asc limit 500'
+    assert params["fields[0]"] == "$id"
+    assert params["fields[1]"] == "更新日時"
+
+
+def test_request_params_first_sync(comments_stream):
+    params = comments_stream.request_params(stream_state={})
+    assert params["query"] == "order by $id asc limit 500"
+
+
+def test_next_page_token(comments_stream):
+    response = MagicMock()
+    response.json.return_value = {"records": [{"$id": {"value": str(i)}} for i in range(1, 501)]}
+    assert comments_stream.next_page_token(response) == {"last_id": "500"}
+    response.json.return_value = {"records": [{"$id": {"value": "1"}}]}
+    assert comments_stream.next_page_token(response) is None
+
+
+def test_comments_are_paged_by_ten(comments_stream, mocker):
+    pages = [
+        {"comments": [{"id": str(i), "text": "t"} for i in range(10)], "older": True},
+        {"comments": [{"id": "10", "text": "t"}], "older": False},
+    ]
+    get_json = mocker.patch.object(AppComments, "_get_json", side_effect=pages)
+    record = {"$id": {"value": "7"}, "更新日時": {"value": "2023-01-02T00:00:00Z"}}
+    comments = comments_stream._read_record_comments(record)
+    assert len(comments) == 11
+    assert [call.kwargs["params"]["offset"] for call in get_json.call_args_list] == [0, 10]
+    assert all(call.kwargs["params"]["limit"] == 10 for call in get_json.call_args_list)
+
+
+def _read_status_stream(stream, updated_times, stream_state, sync_mode=SyncMode.incremental):
+    response = MagicMock()
+    response.json.return_value = {"records": [
+        {"$id": {"value": str(record_id)}, "更新日時": {"value": updated_time},
+         "ステータス": {"value": "完了"}, "作業者": {"value": []}}
+        for record_id, updated_time in enumerate(updated_times, start=1)
+    ]}
+    stream.state = stream_state
+    configured_stream = MagicMock(sync_mode=sync_mode, cursor_field=["record_updated_time"])
+    slice_logger = MagicMock()
+    slice_logger.should_log_slice_message.return_value = False
+    state_manager = MagicMock()
+    internal_config = MagicMock()
+    internal_config.is_limit_reached.return_value = False
+    with patch.object(AppProcessManagement, "_send_request", return_value=response) as send_request:
+        records = [message for message in stream.read(
+            configured_stream, MagicMock(), slice_logger, stream_state, state_manager, internal_config) if isinstance(message, Mapping)]
+    saved_state = state_manager.update_state_for_stream.call_args.args[2]
+    return records, saved_state, send_request
+
+
+def test_read_saves_maximum_cursor():
+    stream = AppProcessManagement(
+        authenticator=KintoneAuthenticator(username="user", password="pass"), domain="https://sample.cybozu.com", app_id="1")
+    stream._field_codes = FIELD_CODES
+    records, saved_state, send_request = _read_status_stream(
+        stream, ["2023-03-01T00:00:00Z", "2023-01-01T00:00:00Z"], {"record_updated_time": "2022-12-01T00:00:00Z"})
+    assert len(records) == 2
+    assert saved_state == {"record_updated_time": "2023-03-01T00:00:00Z"}
+    # The request still filters on the incoming cursor
+    assert '更新日時 >= "2022-12-01T00:00:00Z"' in unquote_plus(send_request.call_args.args[0].url)
+
+
+def test_full_refresh_ignores_saved_cursor():
+    stream = AppProcessManagement(
+        authenticator=KintoneAuthenticator(username="user", password="pass"), domain="https://sample.cybozu.com", app_id="1")
+    stream._field_codes = FIELD_CODES
+    records, _, send_request = _read_status_stream(
+        stream, ["2023-03-01T00:00:00Z", "2023-01-01T00:00:00Z"], {"record_updated_time": "2023-02-01T00:00:00Z"},
+        sync_mode=SyncMode.full_refresh)
+    assert len(records) == 2
+    assert "更新日時 >=" not in unquote_plus(send_request.call_args.args[0].url)
+
+
+def test_process_management_skipped_when_disabled():
+    stream = AppProcessManagement(domain="https://sample.cybozu.com", app_id="1")
+    stream._field_codes = {"UPDATED_TIME": "更新日時"}
+    assert list(stream.read_records(sync_mode="incremental")) == []
+
+
+def test_comments_are_deduplicated_by_record_and_comment(comments_stream):
+    assert comments_stream.primary_key == ["record_id", "comment_id"]
@@ -0,0 +1,78 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+from unittest.mock import MagicMock
+
+import pytest
+from requests.exceptions import HTTPError
+from source_kintone.api import Kintone
+
+CONFIG = {
+    "domain": "https://sample.cybozu.com/",
+    "app_ids": ["1", "2", "3"],
+    "auth_type": {"option": "username_password", "username": "user", "password": "pass"},
+}
+
+
+def _response(status_code=200, body=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = body or {}
+    if status_code >= 400:
+        response.raise_for_status.side_effect = HTTPError(response=response)
+    return response
+
+
+def test_get_app_routes_detects_guest_spaces(mocker):
+    kintone = Kintone(**CONFIG)
+    apps = {"apps": [
+        {"appId": "1", "spaceId": None},
+        {"appId": "2", "spaceId": "10"},
+        {"appId": "3", "spaceId": "20"},
+    ]}
+    get = mocker.patch.object(kintone.session, "get", side_effect=[
+        _response(body=apps), _response(status_code=200), _response(status_code=520, body={"code": "GAIA_IL23"})])
+    assert kintone.get_app_routes() == {"1": None, "2": None, "3": "20"}
+    assert get.call_count == 3
+
+
+def test_get_app_routes_private_space_is_not_guest(mocker):
+    kintone = Kintone(**CONFIG)
+    apps = {"apps": [{"appId": "1", "spaceId": "10"}]}
+    mocker.patch.object(kintone.session, "get", side_effect=[
+        _response(body=apps), _response(status_code=403, body={"code": "CB_NO02"})])
+    assert kintone.get_app_routes() == {"1": None}
+
+
+def test_get_app_routes_raises_other_space_errors(mocker):
+    kintone = Kintone(**CONFIG)
+    apps = {"apps": [{"appId": "1", "spaceId": "10"}]}
+    mocker.patch.object(kintone.session, "get", side_effect=[
+        _response(body=apps), _response(status_code=400, body={"code": "CB_VA01"})])
+    with pytest.raises(HTTPError):
+        kintone.get_app_routes()
+
+
+def test_api_tokens_are_validated_in_one_batch(mocker):
+    config = {**CONFIG, "auth_type": {"option": "api_key", "api_tokens": [
+        {"app_id": "1", "token": "t1"}, {"app_id": "2", "token": "t2"}, {"app_id": "3", "token": "t3,t1"}]}}
+    kintone = Kintone(**config)
+    apps = {"apps": [{"appId": "1", "spaceId": None}, {"appId": "2", "spaceId": "10"}, {"appId": "3", "spaceId": None}]}
+    get = mocker.patch.object(kintone.session, "get", return_value=_response(body=apps))
+    assert kintone.get_app_routes() == {"1": None, "2": None, "3": None}
+    assert get.call_args_list[0].kwargs["headers"] == {"X-Cybozu-API-Token": "t1,t2,t3"}
+    # The app in a space is probed with its own token, space.json does not accept tokens
+    assert get.call_args_list[1].args[0] == "https://sample.cybozu.com/k/v1/app.json"
+    assert get.call_args_list[1].kwargs["headers"] == {"X-Cybozu-API-Token": "t2"}
+    assert get.call_count == 2
+    assert kintone._get_standard_headers(app_ids=["3"]) == {"X-Cybozu-API-Token": "t3,t1"}
+
+
+def test_api_tokens_detect_guest_spaces(mocker):
+    config = {**CONFIG, "app_ids": ["1"], "auth_type": {"option": "api_key", "api_tokens": [{"app_id": "1", "token": "t1"}]}}
+    kintone = Kintone(**config)
+    apps = {"apps": [{"appId": "1", "spaceId": "20"}]}
+    mocker.patch.object(kintone.session, "get", side_effect=[
+        _response(body=apps), _response(status_code=520, body={"code": "GAIA_IL23"})])
+    assert kintone.get_app_routes() == {"1": "20"}
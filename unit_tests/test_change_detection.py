@@ -0,0 +1,98 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+import json
+from unittest.mock import MagicMock, patch
+
+from airbyte_cdk.models import SyncMode
+from source_kintone.auth import KintoneAuthenticator
+from source_kintone.streams import AppDetailChanges
+
+
+def _stream():
+    return AppDetailChanges(authenticator=KintoneAuthenticator(username="user", password="pass"),
+                            domain="https://sample.cybozu.com", app_id="1", include_label=False)
+
+
+def _response(records):
+    response = MagicMock()
+    response.iter_content.return_value = [json.dumps({
+        "records": [
+            {"$id": {"value": str(record_id)}, "$revision": {"value": str(revision)}, "price": {"value": price}}
+            for record_id, revision, price in records
+        ],
+        "totalCount": str(len(records)),
+    }).encode("utf-8")]
+    return response
+
+
+def _read(stream, records, sync_mode=SyncMode.incremental):
+    with patch.object(AppDetailChanges, "_send_request", return_value=_response(records)):
+        yield from stream.read_records(sync_mode=sync_mode)
+
+
+def _sync(stream, records, sync_mode=SyncMode.incremental):
+    return list(_read(stream, records, sync_mode))
+
+
+def test_first_sync_emits_every_record():
+    stream = _stream()
+    stream.state = {}
+    assert len(_sync(stream, [(1, 1, "10"), (2, 1, "20")])) == 2
+
+
+def test_only_new_or_changed_records_are_emitted():
+    previous = _stream()
+    previous.state = {}
+    _sync(previous, [(3, 1, "30"), (2, 1, "20"), (1, 1, "10")])
+
+    stream = _stream()
+    stream.state = previous.state
+    # Record 2 has a new revision, record 3 has a recalculated value without a new revision, record 4 is new
+    emitted = _sync(stream, [(4, 1, "40"), (3, 1, "31"), (2, 2, "21"), (1, 1, "10")])
+    assert [record["$id"] for record in emitted] == ["4", "3", "2"]
+    assert stream.changed_records == 3
+    assert stream.unchanged_records == 1
+
+
+def test_counters_are_reset_on_each_read():
+    stream = _stream()
+    stream.state = {}
+    _sync(stream, [(1, 1, "10"), (2, 1, "20")])
+    stream.state = stream.state
+    assert _sync(stream, [(1, 1, "10"), (2, 1, "20")]) == []
+    assert stream.changed_records == 0
+    assert stream.unchanged_records == 2
+
+
+def test_state_is_kept_until_read_completes():
+    previous = _stream()
+    previous.state = {}
+    _sync(previous, [(1, 1, "10"), (2, 1, "20")])
+
+    stream = _stream()
+    stream.state = previous.state
+    records = _read(stream, [(3, 1, "30"), (2, 1, "20"), (1, 1, "10")])
+    next(records)
+    assert stream.state == previous.state
+    list(records)
+    assert stream.state != previous.state
+
+
+def test_full_refresh_emits_every_record():
+    previous = _stream()
+    previous.state = {}
+    _sync(previous, [(2, 1, "20"), (1, 1, "10")])
+
+    stream = _stream()
+    stream.state = previous.state
+    emitted = _sync(stream, [(3, 1, "30"), (2, 1, "20"), (1, 1, "10")], sync_mode=SyncMode.full_refresh)
+    assert [record["$id"] for record in emitted] == ["3", "2", "1"]
+    # The fingerprints are still rebuilt for the next incremental read
+    stream.state = stream.state
+    assert _sync(stream, [(3, 1, "30"), (2, 1, "20"), (1, 1, "10")]) == []
+
+
+def test_records_are_keyed_by_id():
+    assert _stream().primary_key == "$id"
@@ -0,0 +1,90 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+from unittest.mock import MagicMock
+
+import pytest
+from requests.exceptions import ConnectionError, HTTPError
+from source_kintone.errors import (AUTH, PERMISSION, QUERY_SYNTAX, QUOTA,
+                                   RETRYABLE, UNKNOWN, classify_error)
+from source_kintone.rate_limiting import default_backoff_handler
+from source_kintone.streams import AppDetail
+
+
+def _response(status_code, body=None, invalid_json=False):
+    response = MagicMock()
+    response.status_code = status_code
+    if invalid_json:
+        response.json.side_effect = ValueError("not json")
+    else:
+        response.json.return_value = body
+    return response
+
+
+@pytest.mark.parametrize(
+    ("status_code", "body", "category"),
+    [
+        (401, {"code": "CB_AU01", "message": "..."}, AUTH),
+        (403, {"code": "CB_NO02", "message": "..."}, PERMISSION),
+        (400, {"code": "CB_VA01", "message": "..."}, QUERY_SYNTAX),
+        (520, {"code": "GAIA_LT01", "message": "..."}, RETRYABLE),
+        (403, [{"errorCode": "REQUEST_LIMIT_EXCEEDED", "message": "..."}], QUOTA),
+        (429, None, RETRYABLE),
+        (503, "maintenance", RETRYABLE),
+        (403, [], PERMISSION),
+        (400, {"code": "GAIA_XX99", "message": "新しいエラー"}, UNKNOWN),
+    ],
+)
+def test_classify_error(status_code, body, category):
+    assert classify_error(_response(status_code, body)).category == category
+
+
+def test_classify_error_non_json_body():
+    error = classify_error(_response(502, invalid_json=True))
+    assert error.category == RETRYABLE
+    assert error.code is None
+
+
+def test_classify_error_uses_kintone_message_for_unknown_codes():
+    assert classify_error(_response(400, {"code": "GAIA_XX99", "message": "新しいエラー"})).message == "新しいエラー"
+
+
+RETRY_CASES = [
+    (520, {"code": "GAIA_LT01", "message": "..."}, True),
+    (403, [{"errorCode": "REQUEST_LIMIT_EXCEEDED", "message": "..."}], False),
+    (400, {"code": "CB_VA01", "message": "..."}, False),
+]
+
+
+@pytest.mark.parametrize(("status_code", "body", "retried"), RETRY_CASES)
+def test_backoff_handler_retries_only_retryable_errors(status_code, body, retried):
+    attempts = []
+
+    @default_backoff_handler(max_tries=3, factor=0)
+    def request():
+        attempts.append(status_code)
+        raise HTTPError(response=_response(status_code, body))
+
+    with pytest.raises(HTTPError):
+        request()
+    assert len(attempts) == (3 if retried else 1)
+
+
+def test_backoff_handler_retries_connection_errors():
+    attempts = []
+
+    @default_backoff_handler(max_tries=3, factor=0)
+    def request():
+        attempts.append(None)
+        raise ConnectionError()
+
+    with pytest.raises(ConnectionError):
+        request()
+    assert len(attempts) == 3
+
+
+@pytest.mark.parametrize(("status_code", "body", "retried"), [*RETRY_CASES, (200, {"records": []}, False)])
+def test_stream_should_retry(status_code, body, retried):
+    stream = AppDetail(domain="https://sample.cybozu.com", app_id="1", include_label=False)
+    assert stream.should_retry(_response(status_code, body)) is retried
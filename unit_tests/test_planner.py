@@ -0,0 +1,100 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+import math
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+from requests.exceptions import HTTPError
+from source_kintone.api import Kintone
+from source_kintone.planner import AppPlan, format_plan, plan_app, plan_sync
+
+CONFIG = {
+    "domain": "https://sample.cybozu.com",
+    "app_ids": ["1"],
+    "auth_type": {"option": "username_password", "username": "user", "password": "pass"},
+}
+
+
+def _response(body, content_length, seconds):
+    response = MagicMock()
+    response.json.return_value = body
+    response.content = b"x" * content_length
+    response.elapsed = timedelta(seconds=seconds)
+    return response
+
+
+def _kintone(mocker, total_count):
+    kintone = Kintone(**CONFIG)
+    records = _response({"records": [{}] * 10, "totalCount": str(total_count)}, content_length=10 * 2048, seconds=0.3)
+    fields = _response({"properties": {"a": {}, "b": {}}}, content_length=100, seconds=0.2)
+    mocker.patch.object(kintone, "_make_request", side_effect=[records, fields])
+    return kintone
+
+
+def test_plan_app(mocker):
+    plan = plan_app(_kintone(mocker, total_count=12000), CONFIG, "1", None)
+    assert (plan.records, plan.fields, plan.page_size, plan.pages) == (12000, 2, 500, 24)
+    assert plan.requests == 25
+    assert plan.bytes == 12000 * 2048
+
+
+def test_plan_app_counts_comments_requests(mocker):
+    plan = plan_app(_kintone(mocker, total_count=12000), {**CONFIG, "include_comments": True}, "1", None)
+    assert plan.requests == 25 + 1 + 24 + 12000
+    assert plan.quota_usage > 1
+
+
+def test_plan_app_follows_memory_limit(mocker):
+    plan = plan_app(_kintone(mocker, total_count=1000), {**CONFIG, "memory_limit_mb": 1}, "1", None)
+    assert plan.page_size == 1024 * 1024 // 4 // 2048
+    # The first page is still read at 500 records
+    assert plan.pages == 1 + math.ceil(500 / plan.page_size)
+
+
+def test_format_plan():
+    plans = [AppPlan("https://sample.cybozu.com", "1", 12000, 2, 500, 24, 12025, 12000 * 2048, 600)]
+    table = format_plan(plans).splitlines()
+    assert table[0].split()[:3] == ["DOMAIN", "APP", "RECORDS"]
+    assert "120% (exceeded)" in table[1]
+    assert table[2].startswith("TOTAL")
+
+
+def test_plan_sync_reports_unreachable_app(mocker):
+    mocker.patch.object(Kintone, "get_app_routes", return_value={"1": None, "2": None})
+    forbidden = _response({"code": "CB_NO02", "message": "..."}, content_length=0, seconds=0)
+    forbidden.status_code = 403
+
+    def plan(kintone, config, app_id, guest_space_id):
+        if app_id == "2":
+            raise HTTPError(response=forbidden)
+        return AppPlan(kintone.domain, app_id, 100, 2, 500, 1, 2, 2048, 1)
+
+    mocker.patch("source_kintone.planner.plan_app", side_effect=plan)
+    plans = plan_sync({**CONFIG, "app_ids": ["1", "2"]})
+    assert [(plan.app_id, plan.error) for plan in plans] == [("1", None), ("2", "権限がありません。")]
+    table = format_plan(plans).splitlines()
+    assert table[2].split()[-1] == "権限がありません。"
+    assert table[3].split()[:3] == ["TOTAL", "100", "1"]
+
+
+def test_plan_sync_reports_unreachable_domain(mocker):
+    mocker.patch.object(Kintone, "get_app_routes", side_effect=ValueError("invalid app list"))
+    plans = plan_sync({**CONFIG, "app_ids": ["1", "2"]})
+    assert [(plan.app_id, plan.error) for plan in plans] == [("1", "invalid app list"), ("2", "invalid app list")]
+
+
+def test_plan_sync_looks_up_domains_concurrently(mocker):
+    lookups = []
+    executor_map = mocker.spy(ThreadPoolExecutor, "map")
+    mocker.patch.object(Kintone, "get_app_routes", side_effect=lambda: lookups.append(1) or {"1": None})
+    mocker.patch("source_kintone.planner.plan_app", side_effect=lambda kintone, config, app_id, guest_space_id: AppPlan(
+        kintone.domain, app_id))
+    config = {**CONFIG, "tenants": [{**CONFIG, "domain": "https://other.cybozu.com"}]}
+    plans = plan_sync(config)
+    assert [plan.domain for plan in plans] == ["https://sample.cybozu.com", "https://other.cybozu.com"]
+    assert len(lookups) == 2
+    # One map for the route lookups of every domain, one for the apps
+    assert executor_map.call_count == 2
@@ -0,0 +1,122 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+import json
+import os
+import re
+import tracemalloc
+
+import pytest
+from source_kintone.staging import PageStagingBuffer, iter_json_array
+from source_kintone.streams import AppDetail
+
+MB = 1024 * 1024
+RECORD_BYTES = 64 * 1024
+MEMORY_LIMIT = 8 * MB
+# Set KINTONE_SYNTHETIC_APP_BYTES=2147483648 to also read a synthetic 2 GB app
+FULL_APP_BYTES = int(os.environ.get("KINTONE_SYNTHETIC_APP_BYTES", 0))
+
+
+class SyntheticResponse:
+    """Renders the body of a page while it is downloaded, so that the test itself holds one record at a time"""
+
+    def __init__(self, params: dict, total_count: int):
+        limit, offset = map(int, re.match(r"limit (\d+) offset (\d+)", params["query"]).groups())
+        self.record_ids = range(offset + 1, min(offset + limit, total_count) + 1)
+        self.total_count = total_count
+
+    def iter_content(self, chunk_size: int):
+        yield b'{"records": ['
+        for record_id in self.record_ids:
+            separator = "," if record_id != self.record_ids[0] else ""
+            yield (separator + RECORD_TEMPLATE.format(record_id=record_id)).encode("utf-8")
+        yield f'], "totalCount": "{self.total_count}"}}'.encode("utf-8")
+
+
+def _synthetic_record(record_id: int) -> dict:
+    # Attachments and subtable rows make up most of the size of the record
+    return {
+        "$id": {"type": "__ID__", "value": str(record_id)},
+        "$revision": {"type": "__REVISION__", "value": "1"},
+        "添付ファイル": {"type": "FILE", "value": [{"fileKey": "k" * (RECORD_BYTES // 2), "name": "a.pdf"}]},
+        "テーブル": {"type": "SUBTABLE", "value": [{"id": str(row), "value": {"備考": {"value": "x" * 1000}}} for row in range(28)]},
+    }
+
+
+# Pages are rendered from an encoded record template, so that generating large apps stays cheap
+RECORD_TEMPLATE = json.dumps(_synthetic_record(0)).replace('"value": "0"', '"value": "{record_id}"', 1).replace("{", "{{").replace(
+    "}", "}}").replace("{{record_id}}", "{record_id}")
+
+
+def test_buffer_spills_past_memory_limit():
+    buffer = PageStagingBuffer(memory_limit=10, chunk_size=4)
+    for chunk in (b"0123", b"4567", b"89ab"):
+        buffer.write(chunk)
+    assert buffer.spilled
+    assert buffer.size == 12
+    assert b"".join(buffer) == b"0123456789ab"
+    assert not buffer.spilled
+
+
+def test_buffer_stays_in_memory_under_limit():
+    buffer = PageStagingBuffer(memory_limit=1000)
+    buffer.write(b"{}")
+    assert not buffer.spilled
+    assert list(buffer) == [b"{}"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1024])
+def test_iter_json_array_across_chunks(chunk_size):
+    body = json.dumps({"totalCount": "2", "records": [{"名前": "値", "n": 1.5}, {"名前": "二"}], "next": 10},
+                      ensure_ascii=False).encode("utf-8")
+    other_values = {}
+    chunks = (body[start:start + chunk_size] for start in range(0, len(body), chunk_size))
+    assert list(iter_json_array(chunks, "records", other_values)) == [{"名前": "値", "n": 1.5}, {"名前": "二"}]
+    assert other_values == {"totalCount": "2", "next": 10}
+
+
+def test_iter_json_array_empty():
+    other_values = {}
+    assert list(iter_json_array([b'{"records": [], "totalCount": "0"}'], "records", other_values)) == []
+    assert other_values == {"totalCount": "0"}
+
+
+def _read_app(app_bytes: int, mocker):
+    total_count = app_bytes // RECORD_BYTES
+    stream = AppDetail(domain="https://sample.cybozu.com", app_id="1", include_label=False, memory_limit=MEMORY_LIMIT)
+    spill = mocker.spy(PageStagingBuffer, "_spill")
+    mocker.patch("builtins.print")
+    read_records = 0
+    next_page_token = None
+
+    tracemalloc.start()
+    try:
+        while True:
+            params = stream.request_params(stream_state={}, next_page_token=next_page_token)
+            response = SyntheticResponse(params, total_count)
+            for _ in stream.parse_response(response):
+                read_records += 1
+            next_page_token = stream.next_page_token(response)
+            if not next_page_token:
+                break
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return stream, read_records, total_count, peak, spill
+
+
+def test_peak_memory_stays_under_limit(mocker):
+    stream, read_records, total_count, peak, spill = _read_app(64 * MB, mocker)
+    assert read_records == total_count
+    assert peak < MEMORY_LIMIT
+    # The first page of 500 records spills, then the following pages shrink to fit in memory
+    assert spill.call_count == 1
+    assert stream.page_size * len(RECORD_TEMPLATE.encode("utf-8")) <= MEMORY_LIMIT * stream.page_memory_ratio
+
+
+@pytest.mark.skipif(not FULL_APP_BYTES, reason="set KINTONE_SYNTHETIC_APP_BYTES to read a large synthetic app")
+def test_peak_memory_stays_under_limit_full_app(mocker):
+    _, read_records, total_count, peak, _ = _read_app(FULL_APP_BYTES, mocker)
+    assert read_records == total_count
+    assert peak < MEMORY_LIMIT
@@ -0,0 +1,17 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parents[1]
+
+
+def test_spec_does_not_import_cdk():
+    result = subprocess.run(
+        [sys.executable, "-c", "import sys; from source_kintone.run import run; run(['spec']); "
+                               "assert not any(name.startswith('airbyte_cdk') for name in sys.modules)"],
+        cwd=ROOT, check=True, capture_output=True, text=True)
+    assert '"type": "SPEC"' in result.stdout
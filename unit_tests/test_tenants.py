@@ -0,0 +1,106 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+from unittest.mock import MagicMock
+from urllib.parse import urlparse
+
+import pytest
+from airbyte_cdk.models import ConfiguredAirbyteCatalog
+from airbyte_cdk.sources import AbstractSource
+from source_kintone.api import Kintone
+from source_kintone.source import SourceKintone
+
+AUTH_TYPE = {"option": "username_password", "username": "user", "password": "pass"}
+CONFIG = {
+    "domain": "https://main.cybozu.com",
+    "app_ids": ["1"],
+    "auth_type": AUTH_TYPE,
+    "include_comments": True,
+    "tenants": [{"domain": "https://other.cybozu.com", "app_ids": ["1", "2"], "auth_type": AUTH_TYPE}],
+}
+
+
+@pytest.fixture
+def source(mocker):
+    mocker.patch.object(SourceKintone, "_get_app_routes", return_value={})
+    return SourceKintone()
+
+
+def test_tenant_configs_share_options():
+    tenant_configs = SourceKintone.get_tenant_configs(CONFIG)
+    assert [tenant_config["tenant"] for tenant_config in tenant_configs] == [None, "other.cybozu.com"]
+    assert tenant_configs[1]["app_ids"] == ["1", "2"]
+    assert tenant_configs[1]["include_comments"] is True
+
+
+def test_streams_are_namespaced_per_domain(source):
+    streams = source.streams(CONFIG)
+    assert [(stream.namespace, stream.name) for stream in streams] == [
+        (None, "APP_1"),
+        (None, "APP_1_COMMENTS"),
+        ("other.cybozu.com", "other.cybozu.com__APP_1"),
+        ("other.cybozu.com", "other.cybozu.com__APP_1_COMMENTS"),
+        ("other.cybozu.com", "other.cybozu.com__APP_2"),
+        ("other.cybozu.com", "other.cybozu.com__APP_2_COMMENTS"),
+    ]
+
+
+def test_streams_share_one_connection_pool(source):
+    adapters = {id(stream._session.get_adapter("https://x.cybozu.com")) for stream in source.streams(CONFIG)}
+    assert len(adapters) == 1
+
+
+@pytest.mark.parametrize("domains", [
+    ["https://other.cybozu.com", "https://other.cybozu.com/"],
+    ["https://main.cybozu.com"],
+])
+def test_check_connection_rejects_duplicate_domains(mocker, domains):
+    check = mocker.patch.object(SourceKintone, "_check_tenant_connection", return_value=(True, None))
+    config = {**CONFIG, "tenants": [{"domain": domain, "app_ids": ["1"], "auth_type": AUTH_TYPE} for domain in domains]}
+    connected, error = SourceKintone().check_connection(MagicMock(), config)
+    assert not connected
+    assert urlparse(domains[-1]).hostname in error
+    check.assert_not_called()
+
+
+def test_check_connection_reports_failing_domain(mocker):
+    def check(logger, config):
+        return (False, "この情報では認証できません。") if config["tenant"] else (True, None)
+
+    mocker.patch.object(SourceKintone, "_check_tenant_connection", side_effect=check)
+    assert SourceKintone().check_connection(MagicMock(), CONFIG) == (
+        False, "https://other.cybozu.com: この情報では認証できません。")
+
+
+def test_api_tokens_are_routed_per_app(source):
+    config = {"domain": "https://main.cybozu.com", "app_ids": ["1", "2"], "auth_type": {
+        "option": "api_key", "api_tokens": [{"app_id": "1", "token": "t1"}, {"app_id": "2", "token": "t2,t1"}]}}
+    streams = source.streams(config)
+    assert [stream.authenticator.get_auth_header() for stream in streams] == [
+        {"X-Cybozu-API-Token": "t1"}, {"X-Cybozu-API-Token": "t2,t1"}]
+
+
+def test_read_takes_app_routes_from_catalog(mocker):
+    get_app_routes = mocker.patch.object(Kintone, "get_app_routes")
+    source = SourceKintone()
+    catalog = ConfiguredAirbyteCatalog.parse_obj({"streams": [{
+        "stream": {"name": "APP_1", "json_schema": {"kintone_app_id": "1", "kintone_guest_space_id": "5"},
+                   "supported_sync_modes": ["full_refresh"]},
+        "sync_mode": "full_refresh",
+        "destination_sync_mode": "overwrite",
+    }]})
+    mocker.patch.object(AbstractSource, "read", side_effect=lambda logger, config, catalog, state: iter(source.streams(config)))
+    streams = list(source.read(MagicMock(), {**CONFIG, "tenants": []}, catalog))
+    assert [stream.guest_space_id for stream in streams] == ["5", "5"]
+    get_app_routes.assert_not_called()
+
+
+def test_tenants_accept_every_authentication_method(source):
+    spec = source.spec(MagicMock()).connectionSpecification
+    assert spec["properties"]["tenants"]["items"]["properties"]["auth_type"] == spec["properties"]["auth_type"]
+
+    tenant = {"domain": "https://other.cybozu.com", "app_ids": ["2"], "auth_type": {
+        "option": "api_key", "api_tokens": [{"app_id": "2", "token": "t2"}]}}
+    streams = source.streams({**CONFIG, "include_comments": False, "tenants": [tenant]})
+    assert [stream.authenticator.get_auth_header() for stream in streams][1:] == [{"X-Cybozu-API-Token": "t2"}]
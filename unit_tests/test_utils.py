@@ -0,0 +1,75 @@
+#
+# Copyright (c) 2023 Airbyte, Inc., all rights reserved.
+#
+
+from source_kintone.utils import (PackedFingerprints, batch_apps_by_tokens,
+                                  build_api_url, decode_fingerprints,
+                                  encode_fingerprints, generate_mapping_result,
+                                  group_api_tokens, hash_record,
+                                  join_api_tokens, resolve_field_labels)
+
+
+def test_resolve_field_labels_unique_labels():
+    assert resolve_field_labels({"price": "金額", "name": "名前"}) == {"price": "金額", "name": "名前"}
+
+
+def test_resolve_field_labels_disambiguates_collisions():
+    resolved = resolve_field_labels({"price": "金額", "tax": "金額", "name": "名前"})
+    assert resolved == {"price": "金額_price", "tax": "金額_tax", "name": "名前"}
+
+
+def test_resolve_field_labels_suffix_collides_with_label():
+    resolved = resolve_field_labels({"a": "x", "b": "x", "c": "x_a"})
+    assert len(set(resolved.values())) == 3
+    assert resolved["c"] == "x_a"
+
+
+def test_generate_mapping_result_keeps_colliding_fields():
+    mapping_dict = {"$id": "$id", "price": "金額_price", "tax": "金額_tax"}
+    records = [{"$id": {"value": "1"}, "price": {"value": "100"}, "tax": {"value": "10"}}]
+    assert list(generate_mapping_result(records, mapping_dict, include_label=True)) == [
+        {"$id": "1", "金額_price": "100", "金額_tax": "10"}
+    ]
+
+
+def test_build_api_url():
+    assert build_api_url("https://sample.cybozu.com", "records.json") == "https://sample.cybozu.com/k/v1/records.json"
+    assert build_api_url("https://sample.cybozu.com", "records.json", "3") == "https://sample.cybozu.com/k/guest/3/v1/records.json"
+
+
+def test_fingerprints_round_trip():
+    expected = {100000: (12, hash_record({})), 1: (3, hash_record({"a": 1})), 7: (1, hash_record({"a": 2}))}
+    fingerprints = PackedFingerprints()
+    for record_id, (revision, content_hash) in expected.items():
+        fingerprints.add(record_id, revision, content_hash)
+    decoded = decode_fingerprints(encode_fingerprints(fingerprints))
+    assert list(decoded.record_ids) == [1, 7, 100000]
+    assert {record_id: decoded.get(record_id) for record_id in expected} == expected
+    assert decoded.get(2) is None
+    assert len(decode_fingerprints(None)) == 0
+
+
+def test_fingerprints_sort_descending_pages():
+    fingerprints = PackedFingerprints()
+    for record_id in (5, 3, 1):
+        fingerprints.add(record_id, record_id * 10, hash_record({"id": record_id}))
+    fingerprints.sort()
+    assert list(fingerprints.record_ids) == [1, 3, 5]
+    assert fingerprints.get(3) == (30, hash_record({"id": 3}))
+
+
+def test_hash_record_ignores_key_order():
+    assert hash_record({"a": 1, "b": "x"}) == hash_record({"b": "x", "a": 1})
+    assert hash_record({"a": 1}) != hash_record({"a": 2})
+
+
+def test_group_api_tokens():
+    api_tokens = [{"app_id": "1", "token": "a, b"}, {"app_id": "1", "token": "a"}, {"app_id": "2", "token": "c"}]
+    assert group_api_tokens(api_tokens) == {"1": ["a", "b"], "2": ["c"]}
+    assert join_api_tokens(group_api_tokens(api_tokens), ["1", "2"]) == "a,b,c"
+
+
+def test_batch_apps_by_tokens_respects_header_limit():
+    api_tokens = {str(app_id): [f"token{app_id}"] for app_id in range(20)}
+    batches = batch_apps_by_tokens(api_tokens, list(api_tokens), max_apps=100)
+    assert [len(batch) for batch in batches] == [9, 9, 2]